@@ -0,0 +1,240 @@
+"""Benchmarks for the physics kernels and the app rerun.
+
+    python benchmarks/run.py                       # run and compare with the baseline
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --update-baseline     # store this run as the new baseline
+    python benchmarks/run.py --only speed          # benchmarks whose name contains "speed"
+
+Every benchmark is timed like timeit: the number of calls per measurement
+grows until one measurement takes at least --min-time seconds, then the
+measurement is repeated and the fastest per-call time is kept, which is the
+least disturbed by other load. Like timeit, garbage collection is off while
+timing. A full app run takes a few hundred ms and its fastest run is still
+noisy, so the app benchmarks are repeated APP_REPEAT times and compared on
+the median. Inputs come from a seeded generator, so runs are comparable. A
+benchmark regresses when it is slower than the baseline by more than its
+threshold (a ratio; the baseline's "thresholds" entry, or --threshold); the
+script then exits with status 1.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bikecalc.course import simulate_course  # noqa: E402
+from bikecalc.physics import calculate_power, calculate_power_batch, calculate_speed, calculate_speed_batch  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+DEFAULT_THRESHOLD = 1.25
+BATCH_SIZE = 100_000
+COURSE_SIZES = (100, 1_000, 10_000, 100_000)  # segments
+APP_REPEAT = 21
+
+# A typical rider: total weight, CdA, Crr, air density, drivetrain efficiency
+RIDER = dict(total_weight=84.5, cda=0.32, crr=0.004, air_density=1.2, drivetrain_efficiency=97.5)
+
+def _scenarios(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return dict(
+        power=rng.uniform(100, 400, n),
+        speed_ms=rng.uniform(3, 15, n),
+        total_weight=rng.uniform(60, 110, n),
+        grade=rng.uniform(-8, 12, n),
+        cda=rng.uniform(0.2, 0.45, n),
+        crr=rng.uniform(0.0025, 0.007, n),
+        wind_speed_ms=rng.uniform(-5, 5, n),
+        air_density=rng.uniform(1.0, 1.3, n),
+        drivetrain_efficiency=rng.uniform(95, 99, n),
+    )
+
+def _course(n, seed=0):
+    rng = np.random.default_rng(seed)
+    grade = np.clip(np.cumsum(rng.normal(0, 0.5, n)), -12, 12)
+    segment_length = np.full(n, 100.0)
+    altitude = 100 + np.cumsum(grade * segment_length / 100)
+    return segment_length, grade, altitude
+
+# name -> zero-argument callable
+def physics_benchmarks():
+    s = _scenarios(BATCH_SIZE)
+    benchmarks = {
+        "calculate_power_scalar": lambda: calculate_power(
+            9.0, RIDER["total_weight"], 2.0, RIDER["cda"], RIDER["crr"], 1.0, RIDER["air_density"],
+            RIDER["drivetrain_efficiency"]),
+        "calculate_power_batch_100k": lambda: calculate_power_batch(
+            s["speed_ms"], s["total_weight"], s["grade"], s["cda"], s["crr"], s["wind_speed_ms"], s["air_density"],
+            s["drivetrain_efficiency"]),
+        "calculate_speed_batch_100k": lambda: calculate_speed_batch(
+            s["power"], s["total_weight"], s["grade"], s["cda"], s["crr"], s["wind_speed_ms"], s["air_density"],
+            s["drivetrain_efficiency"]),
+    }
+    for method in ("cubic", "newton"):
+        benchmarks[f"calculate_speed_{method}"] = lambda method=method: calculate_speed(
+            250.0, RIDER["total_weight"], 2.0, RIDER["cda"], RIDER["crr"], 1.0, RIDER["air_density"],
+            RIDER["drivetrain_efficiency"], method=method)
+
+    # The speed-power curve of the calculator tab
+    speeds_ms = np.linspace(10, 45, 36) / 3.6
+    benchmarks["speed_power_curve"] = lambda: calculate_power_batch(
+        speeds_ms, RIDER["total_weight"], 2.0, RIDER["cda"], RIDER["crr"], 0.0, RIDER["air_density"],
+        RIDER["drivetrain_efficiency"])
+
+    for n in COURSE_SIZES:
+        segment_length, grade, altitude = _course(n)
+        benchmarks[f"simulate_course_{n}"] = lambda segment_length=segment_length, grade=grade, altitude=altitude: (
+            simulate_course(segment_length, grade, altitude, 250.0, RIDER["total_weight"], RIDER["cda"], RIDER["crr"],
+                            0.0, 20.0, RIDER["drivetrain_efficiency"]))
+    return benchmarks
+
+# Full-script runs of streamlit_app.py through Streamlit's AppTest harness:
+# the first run starts with empty caches, the rerun reuses them
+def app_benchmarks():
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("streamlit not installed; skipping the app benchmarks", file=sys.stderr)
+        return {}
+    import streamlit as st
+
+    app_path = os.path.join(ROOT, "streamlit_app.py")
+    state = {}
+
+    def first_run():
+        st.cache_data.clear()
+        state["app"] = AppTest.from_file(app_path, default_timeout=60)
+        state["app"].run()
+
+    def rerun():
+        if "app" not in state:
+            first_run()
+        state["app"].run()
+
+    return {"app_first_run": first_run, "app_rerun": rerun}
+
+# Fastest and median seconds per call of func; `statistic` names the one
+# compared with the baseline
+def measure(func, repeat=5, min_time=0.2, statistic="best"):
+    func()  # warm up
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(func, repeat, min_time, statistic)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def _measure(func, repeat, min_time, statistic):
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+    return {"best": min(timings), "median": statistics.median(timings), "loops": loops, "repeat": repeat,
+            "statistic": statistic}
+
+def run(only=None, repeat=5, min_time=0.2, app=True):
+    benchmarks = {name: (func, repeat, "best") for name, func in physics_benchmarks().items()}
+    if app:
+        benchmarks.update({name: (func, max(repeat, APP_REPEAT), "median") for name, func in app_benchmarks().items()})
+    results = {}
+    for name, (func, name_repeat, statistic) in benchmarks.items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func, name_repeat, min_time, statistic)
+        print(f"{name:32s} {_format_seconds(results[name]['best']):>10s}  (median {_format_seconds(results[name]['median'])})")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+# Compare with a baseline; returns the names of regressed benchmarks
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    print(f"\n{'benchmark':32s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        statistic = result.get("statistic", "best")
+        reference = baseline["results"][name][statistic]
+        ratio = result[statistic] / reference
+        limit = thresholds.get(name, threshold)
+        regressed = ratio > limit
+        if regressed:
+            regressions.append(name)
+        print(f"{name:32s} {_format_seconds(reference):>10s} {_format_seconds(result[statistic]):>10s} {ratio:6.2f}x"
+              + (f"  REGRESSION (> {limit:.2f}x)" if regressed else ""))
+    return regressions
+
+def _format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown ratio that counts as a regression")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement")
+    parser.add_argument("--no-app", action="store_true", help="skip the Streamlit app benchmarks")
+    args = parser.parse_args(argv)
+
+    report = run(args.only, args.repeat, args.min_time, app=not args.no_app)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        thresholds = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                thresholds = json.load(f).get("thresholds", {})
+        with open(args.baseline, "w") as f:
+            json.dump({**report, "thresholds": thresholds}, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Headless physics and metrics for the Bike Power Speed Calculator."""
@@ -0,0 +1,3 @@
+from bikecalc.cli import main
+
+main()
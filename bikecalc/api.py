@@ -0,0 +1,187 @@
+"""HTTP JSON API for the calculator, without Streamlit.
+
+A plain WSGI application using only the standard library and the bikecalc
+modules. Every calculation has a single and a batch endpoint:
+
+    POST /calculator          one scenario of the power-speed calculator
+    POST /calculator/batch    a list of scenarios
+    POST /training            one workout of the training metrics
+    POST /training/batch      a list of workouts
+    POST /race                one race of the race predictor
+    POST /race/batch          a list of races
+    GET  /health
+
+Request fields are the column names of bikecalc.batch and other fields are
+ignored; a race may give event_type instead of power_percent. Results that
+are not finite numbers are returned as null. A batch is solved with one vectorized
+call however many items it holds. Responses are cached per process on a
+digest of the request body, up to RESPONSE_CACHE_BYTES of encoded responses,
+so repeated payloads skip the physics.
+
+Run it locally with
+
+    python -m bikecalc.api --port 8000
+
+or on a multi-process WSGI server, e.g. gunicorn -w 4 bikecalc.api:application
+"""
+import argparse
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
+
+import numpy as np
+
+from bikecalc.batch import (
+    EVENT_POWER_PERCENT,
+    RACE_COLUMNS,
+    SCENARIO_COLUMNS,
+    TARGET_COLUMNS,
+    TRAINING_COLUMNS,
+    evaluate_races,
+    evaluate_scenarios,
+    evaluate_training,
+)
+
+RESPONSE_CACHE_BYTES = 64 << 20  # encoded responses kept per process
+MAX_BODY_BYTES = 32 << 20
+
+# Prepare race rows: event_type names become power_percent
+def _race_rows(rows):
+    prepared = []
+    for row in rows:
+        if "event_type" in row:
+            row = dict(row)
+            event_type = row.pop("event_type")
+            if event_type not in EVENT_POWER_PERCENT:
+                raise ValueError(f"Unknown event_type: {event_type}")
+            row.setdefault("power_percent", EVENT_POWER_PERCENT[event_type])
+        prepared.append(row)
+    return prepared
+
+# Endpoint -> (evaluate, prepare rows, accepted fields)
+CALCULATIONS = {
+    "calculator": (evaluate_scenarios, None, {*SCENARIO_COLUMNS, *TARGET_COLUMNS}),
+    "training": (evaluate_training, None, set(TRAINING_COLUMNS)),
+    "race": (evaluate_races, _race_rows, {*SCENARIO_COLUMNS, *RACE_COLUMNS}),
+}
+
+# Rows (dicts) to columns of the accepted fields; other fields are ignored,
+# and a field missing from a row is NaN, which takes the column default
+def _columns(rows, fields):
+    names = {name for row in rows for name in row if name in fields}
+    return {name: np.array([row.get(name, np.nan) for row in rows], dtype=float) for name in names}
+
+# Result arrays back to one dict per row, with null for NaN and infinity,
+# which JSON cannot represent
+def _rows(results, n):
+    values = {}
+    for name, column in results.items():
+        column = np.asarray(column, dtype=float)
+        values[name] = np.where(np.isfinite(column), column, np.nan).tolist()
+    return [{name: (None if column[i] != column[i] else column[i]) for name, column in values.items()} for i in range(n)]
+
+# Evaluate a request body for an endpoint; returns (status, JSON payload)
+def handle(path, body):
+    parts = path.strip("/").split("/")
+    if parts[0] not in CALCULATIONS or len(parts) > 2 or (len(parts) == 2 and parts[1] != "batch"):
+        return "404 Not Found", {"error": f"Unknown endpoint: {path}"}
+    evaluate, prepare, fields = CALCULATIONS[parts[0]]
+    batch = len(parts) == 2
+
+    try:
+        payload = json.loads(body)
+        rows = payload if batch else [payload]
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Expected a JSON list of objects" if batch else "Expected a JSON object")
+        if not rows:
+            return "200 OK", []
+        if prepare is not None:
+            rows = prepare(rows)
+        results = _rows(evaluate(_columns(rows, fields)), len(rows))
+    except (ValueError, TypeError) as error:
+        return "400 Bad Request", {"error": str(error)}
+    return "200 OK", results if batch else results[0]
+
+# Least recently used (status, encoded response) pairs, bounded by the total
+# size of the responses rather than their number. Keys are digests, so the
+# request bodies are not kept, and a response larger than a quarter of the
+# budget is not cached at all.
+class _ResponseCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, status, body):
+        if len(body) > self.max_bytes // 4:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (status, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+_response_cache = _ResponseCache(RESPONSE_CACHE_BYTES)
+
+# Answer repeated payloads from memory
+def _cached_response(path, body):
+    key = hashlib.sha256(path.encode() + b"\0" + body).digest()
+    cached = _response_cache.get(key)
+    if cached is None:
+        status, payload = handle(path, body)
+        cached = status, json.dumps(payload).encode()
+        _response_cache.put(key, *cached)
+    return cached
+
+def _respond(start_response, status, payload):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+    return [body]
+
+def application(environ, start_response):
+    path = environ.get("PATH_INFO", "/")
+    method = environ["REQUEST_METHOD"]
+    if path == "/health" and method == "GET":
+        return _respond(start_response, "200 OK", {"status": "ok"})
+    if method != "POST":
+        return _respond(start_response, "405 Method Not Allowed", {"error": "Use POST"})
+
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_BODY_BYTES:
+        return _respond(start_response, "413 Payload Too Large", {"error": "Request body too large"})
+    body = environ["wsgi.input"].read(length)
+    status, payload = _cached_response(path, body)
+    return _respond(start_response, status, payload)
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bikecalc.api", description="Serve the calculator as a JSON API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    with make_server(args.host, args.port, application, server_class=ThreadingWSGIServer) as server:
+        print(f"Serving on http://{args.host}:{args.port}")
+        server.serve_forever()
+
+if __name__ == "__main__":
+    main()
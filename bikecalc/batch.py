@@ -0,0 +1,164 @@
+"""Evaluate many ride scenarios at once.
+
+A scenario is one row of the power-speed calculator: rider, bike and course
+parameters plus a target power, speed or finish time. Races (the race
+predictor) and workouts (the training metrics) are tables too. Columns are
+NumPy arrays, so a whole table is solved with one call into the vectorized
+physics.
+"""
+import numpy as np
+
+from bikecalc.physics import calculate_air_density, calculate_power_batch, calculate_speed_batch
+from bikecalc.powerduration import race_power
+
+# Input columns and their defaults (those of the calculator tab); None marks
+# a required column
+SCENARIO_COLUMNS = {
+    "rider_weight": 75.0,  # kg
+    "gear_weight": 1.5,  # kg
+    "bike_weight": 8.0,  # kg
+    "cda": None,  # m²
+    "crr": None,
+    "distance_km": None,
+    "elevation_m": 0.0,  # total climb
+    "wind_kmh": 0.0,  # + headwind / - tailwind
+    "temperature": 20.0,  # °C
+    "altitude": 100.0,  # m
+    "drivetrain_efficiency": 97.5,  # %
+    "ftp": 250.0,  # W
+}
+
+# Every scenario sets exactly one of these; the others are NaN or missing
+TARGET_COLUMNS = ("target_power", "target_speed_kmh", "target_time_s")
+
+RESULT_COLUMNS = ("speed_kmh", "power_w", "time_s", "intensity_factor", "tss")
+
+# Race predictor inputs on top of SCENARIO_COLUMNS. Race power is
+# power_percent of FTP, or comes from the critical power model where cp is
+# given (see bikecalc.powerduration.race_power).
+RACE_COLUMNS = {
+    "power_percent": 0.95,  # share of FTP
+    "cp": np.nan,  # W
+    "w_prime_kj": 20.0,
+}
+
+# Share of FTP held in each event type of the race predictor
+EVENT_POWER_PERCENT = {
+    "Time trial": 0.95,
+    "Road race": 0.85,
+    "Criterium": 0.90,
+    "Gran fondo": 0.80,
+}
+
+# Training metrics inputs: normalized power, or else the intensity in percent
+# of FTP of a planned workout
+TRAINING_COLUMNS = {
+    "ftp": 250.0,  # W
+    "duration_hours": None,
+    "normalized_power": np.nan,  # W
+    "intensity_percent": np.nan,
+}
+
+# One column of a table as a float array; missing values (NaN) take the
+# default, and default None marks a required column
+def _column(table, name, default, n):
+    if name not in table:
+        if default is None:
+            raise ValueError(f"Missing column: {name}")
+        return np.full(n, default)
+    values = np.asarray(table[name], dtype=float)
+    if default is not None and not np.isnan(default):
+        values = np.where(np.isnan(values), default, values)
+    return values
+
+def _table_arrays(table, columns):
+    n = len(table[next(iter(table))])
+    return {name: _column(table, name, default, n) for name, default in columns.items()}
+
+# Fill in defaults and check the columns of a scenario table (a dict of
+# arrays, or anything with the same item access such as a DataFrame).
+# Returns a dict of float arrays holding every scenario and target column.
+def scenario_arrays(table):
+    if not any(name in table for name in TARGET_COLUMNS):
+        raise ValueError(f"Scenarios need one of the columns {', '.join(TARGET_COLUMNS)}")
+    return _table_arrays(table, {**SCENARIO_COLUMNS, **dict.fromkeys(TARGET_COLUMNS, np.nan)})
+
+# Speed, power, finish time, IF and TSS of every scenario, as the calculator
+# tab computes them: steady state at the average grade of the distance and
+# climb. Rows with a target power are solved for speed; the others get the
+# power needed for the target speed, or for the speed that covers the
+# distance in the target time. Returns a dict of arrays keyed by
+# RESULT_COLUMNS.
+def evaluate_scenarios(table):
+    s = scenario_arrays(table)
+    total_weight = s["rider_weight"] + s["gear_weight"] + s["bike_weight"]
+    distance_m = s["distance_km"] * 1000
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grade = np.where(distance_m > 0, 100 * s["elevation_m"] / distance_m, 0.0)
+    wind_speed_ms = s["wind_kmh"] / 3.6
+    air_density = calculate_air_density(s["temperature"], s["altitude"])
+
+    # Target speed from the speed or time column, where given
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed_ms = np.where(np.isfinite(s["target_speed_kmh"]), s["target_speed_kmh"] / 3.6,
+                            distance_m / s["target_time_s"])
+    by_power = np.isfinite(s["target_power"])
+
+    power = np.array(s["target_power"])
+    if by_power.any():
+        speed_ms[by_power] = calculate_speed_batch(
+            s["target_power"][by_power], total_weight[by_power], grade[by_power], s["cda"][by_power],
+            s["crr"][by_power], wind_speed_ms[by_power], air_density[by_power],
+            s["drivetrain_efficiency"][by_power])
+    if not by_power.all():
+        by_speed = ~by_power
+        power[by_speed], _, _, _ = calculate_power_batch(
+            speed_ms[by_speed], total_weight[by_speed], grade[by_speed], s["cda"][by_speed], s["crr"][by_speed],
+            wind_speed_ms[by_speed], air_density[by_speed], s["drivetrain_efficiency"][by_speed])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time_s = np.where(speed_ms > 0, distance_m / speed_ms, np.where(np.isnan(speed_ms), np.nan, 0.0))
+        intensity_factor = np.where(s["ftp"] > 0, power / s["ftp"], 0.0)
+    tss = time_s / 3600 * intensity_factor**2 * 100
+
+    return {
+        "speed_kmh": speed_ms * 3.6,
+        "power_w": power,
+        "time_s": time_s,
+        "intensity_factor": intensity_factor,
+        "tss": tss,
+    }
+
+# Race predictor results for a table of races (SCENARIO_COLUMNS plus
+# RACE_COLUMNS); returns a dict of arrays keyed by RESULT_COLUMNS
+def evaluate_races(table):
+    s = _table_arrays(table, {**SCENARIO_COLUMNS, **RACE_COLUMNS})
+    power = s["ftp"] * s["power_percent"]
+
+    by_cp = np.isfinite(s["cp"])
+    if by_cp.any():
+        total_weight = s["rider_weight"] + s["gear_weight"] + s["bike_weight"]
+        distance_m = s["distance_km"] * 1000
+        with np.errstate(divide="ignore", invalid="ignore"):
+            grade = np.where(distance_m > 0, 100 * s["elevation_m"] / distance_m, 0.0)
+        air_density = calculate_air_density(s["temperature"], s["altitude"])
+        power[by_cp], _, _ = race_power(
+            distance_m[by_cp], s["cp"][by_cp], s["w_prime_kj"][by_cp] * 1000, total_weight[by_cp], grade[by_cp],
+            s["cda"][by_cp], s["crr"][by_cp], s["wind_kmh"][by_cp] / 3.6, air_density[by_cp],
+            s["drivetrain_efficiency"][by_cp])
+
+    return evaluate_scenarios({**s, "target_power": power})
+
+# Intensity factor and TSS for a table of workouts (TRAINING_COLUMNS);
+# returns a dict with normalized_power, intensity_factor and tss arrays
+def evaluate_training(table):
+    s = _table_arrays(table, TRAINING_COLUMNS)
+    normalized_power = np.where(np.isfinite(s["normalized_power"]), s["normalized_power"],
+                                s["ftp"] * s["intensity_percent"] / 100)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intensity_factor = np.where(s["ftp"] > 0, normalized_power / s["ftp"], 0.0)
+    return {
+        "normalized_power": normalized_power,
+        "intensity_factor": intensity_factor,
+        "tss": s["duration_hours"] * intensity_factor**2 * 100,
+    }
@@ -0,0 +1,131 @@
+"""Command-line batch predictions.
+
+    python -m bikecalc scenarios.csv predictions.csv --workers 8
+
+Reads a CSV or Parquet table of scenarios (columns as in bikecalc.batch),
+evaluates it chunk by chunk across a process pool and writes the input
+columns followed by speed_kmh, power_w, time_s, intensity_factor and tss.
+Memory stays bounded by the chunk size times the number of chunks in flight,
+however long the table is. Formatting CSV output costs more than the physics,
+so the workers return finished CSV text; with pyarrow installed it is
+written by pyarrow's much faster CSV writer. Parquet needs pyarrow.
+"""
+import argparse
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from bikecalc.batch import RESULT_COLUMNS, SCENARIO_COLUMNS, TARGET_COLUMNS, evaluate_scenarios
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support and fast CSV output are optional
+    pa = pacsv = pq = None
+
+CHUNK_ROWS = 250_000
+
+# pandas infers the dtypes of every CSV chunk on its own, so a column of whole
+# numbers is int64 in one chunk and float64 in the next if that has a blank.
+# The scenario columns are always read as float64.
+CSV_DTYPES = {name: float for name in (*SCENARIO_COLUMNS, *TARGET_COLUMNS)}
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in (".parquet", ".pq")
+
+def _require_pyarrow():
+    if pq is None:
+        raise SystemExit("Parquet files need pyarrow: pip install pyarrow")
+
+# Yield the input table as DataFrames of at most chunk_rows rows
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    if _is_parquet(path):
+        _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=CSV_DTYPES)
+
+# Input columns followed by the predictions
+def evaluate_chunk(frame):
+    results = evaluate_scenarios(frame)
+    return frame.assign(**{name: results[name] for name in RESULT_COLUMNS})
+
+def format_csv(frame, header=True):
+    if pacsv is None:
+        return frame.to_csv(index=False, header=header).encode()
+    sink = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(frame, preserve_index=False), sink, pacsv.WriteOptions(include_header=header))
+    return sink.getvalue()
+
+# Worker task: the predictions for one chunk as an Arrow table (Parquet
+# output) or as CSV bytes, with the header only on the first chunk
+def _process_chunk(frame, parquet, header):
+    frame = evaluate_chunk(frame)
+    if parquet:
+        return len(frame), pa.Table.from_pandas(frame, preserve_index=False)
+    return len(frame), format_csv(frame, header)
+
+# Process chunks in order, with at most `pending` of them queued in the pool
+def _process_in_pool(tasks, workers, pending):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        queue = deque()
+        for task in tasks:
+            queue.append(pool.submit(_process_chunk, *task))
+            if len(queue) >= pending:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+# Run the scenarios in input_path and write the predictions to output_path.
+# workers=1 evaluates in this process. Returns the number of rows written.
+def run(input_path, output_path, chunk_rows=CHUNK_ROWS, workers=None):
+    workers = workers or os.cpu_count() or 1
+    parquet = _is_parquet(output_path)
+    if parquet:
+        _require_pyarrow()
+    tasks = ((chunk, parquet, index == 0) for index, chunk in enumerate(read_chunks(input_path, chunk_rows)))
+    if workers == 1:
+        results = (_process_chunk(*task) for task in tasks)
+    else:
+        results = _process_in_pool(tasks, workers, 2 * workers)
+
+    rows = 0
+    if parquet:
+        writer = None
+        try:
+            for size, table in results:
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                # Other columns can still differ between chunks; the file
+                # keeps the first chunk's schema
+                writer.write_table(table.cast(writer.schema))
+                rows += size
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(output_path, "wb") as output:
+            for size, text in results:
+                output.write(text)
+                rows += size
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bikecalc",
+                                     description="Predict speed, power, time, IF and TSS for a table of ride scenarios.")
+    parser.add_argument("input", help="CSV or Parquet file of scenarios")
+    parser.add_argument("output", help="CSV or Parquet file for the predictions")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows evaluated per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = run(args.input, args.output, args.chunk_rows, args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"{rows} scenarios written to {args.output}")
@@ -0,0 +1,86 @@
+"""Course import and per-segment race simulation.
+
+A route is reduced to fixed-length segments, each with its own grade and
+altitude, and the speed on every segment is solved in one vectorized call.
+"""
+import io
+
+import numpy as np
+
+from bikecalc.physics import calculate_air_density, calculate_speed_batch
+from bikecalc.ridefile import EARTH_RADIUS, iter_ride_chunks
+
+# Read the track points of a FIT, GPX or TCX file (bytes); returns (lat, lon,
+# elevation) arrays. Points without a position are dropped.
+def read_course(data):
+    lat, lon, elevation = [], [], []
+    for chunk in iter_ride_chunks(io.BytesIO(data), fields=("lat", "lon", "altitude")):
+        has_position = np.isfinite(chunk["lat"]) & np.isfinite(chunk["lon"])
+        lat.append(chunk["lat"][has_position])
+        lon.append(chunk["lon"][has_position])
+        elevation.append(chunk["altitude"][has_position])
+    if not lat:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    return np.concatenate(lat), np.concatenate(lon), np.concatenate(elevation)
+
+# Cumulative distance (m) along a track from haversine steps between points
+def track_distance(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    h = np.sin(dlat / 2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2)**2
+    steps = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+# Split a track into segments of segment_length metres (the last one may be
+# shorter). Returns (segment_end_m, segment_length_m, grade, altitude) where
+# grade is in percent and altitude is the segment's mean elevation. Missing
+# elevations are interpolated from their neighbours.
+def segment_course(distance, elevation, segment_length=100.0):
+    distance = np.asarray(distance, dtype=float)
+    elevation = np.asarray(elevation, dtype=float)
+
+    known = np.isfinite(elevation)
+    if not known.any():
+        elevation = np.zeros_like(distance)
+    elif not known.all():
+        elevation = np.interp(distance, distance[known], elevation[known])
+
+    total = distance[-1]
+    edges = np.arange(0.0, total, segment_length)
+    edges = np.append(edges, total)
+    edge_elevation = np.interp(edges, distance, elevation)
+
+    lengths = np.diff(edges)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grade = np.where(lengths > 0, 100 * np.diff(edge_elevation) / lengths, 0.0)
+    altitude = (edge_elevation[:-1] + edge_elevation[1:]) / 2
+
+    return edges[1:], lengths, grade, altitude
+
+# Total positive elevation change (m) over the segments
+def elevation_gain(segment_length, grade):
+    climb = np.asarray(segment_length) * np.asarray(grade) / 100
+    return float(climb[climb > 0].sum())
+
+# Ride every segment at the given power. power may be a scalar or one value
+# per segment; wind_speed_ms is + headwind / - tailwind. Air density follows
+# each segment's altitude. Returns (speed_ms, segment_time_s).
+def simulate_course(segment_length, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                    drivetrain_efficiency, max_speed=None):
+    air_density = calculate_air_density(temperature, altitude)
+    speed_ms = calculate_speed_batch(power, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                                     drivetrain_efficiency, max_speed=max_speed)
+    with np.errstate(divide="ignore"):
+        segment_time = np.asarray(segment_length, dtype=float) / speed_ms
+    return speed_ms, segment_time
+
+# Elapsed time at every split_length metres (and at the finish), interpolated
+# from the per-segment times. Returns (split_distance_m, elapsed_s).
+def course_splits(segment_end, segment_time, split_length=5000.0):
+    segment_end = np.asarray(segment_end, dtype=float)
+    elapsed = np.concatenate(([0.0], np.cumsum(segment_time)))
+    distance = np.concatenate(([0.0], segment_end))
+    split_distance = np.append(np.arange(split_length, distance[-1], split_length), distance[-1])
+    return split_distance, np.interp(split_distance, distance, elapsed)
@@ -0,0 +1,115 @@
+"""Training metrics from recorded power streams.
+
+Streams are resampled to one value per second of riding first: samples within
+the same second are averaged, short dropouts hold the last value and long
+pauses are cut out, so the 30 s rolling mean behind normalized power only sees
+time spent on the bike.
+"""
+import numpy as np
+
+from bikecalc.physics import calculate_intensity_factor, calculate_tss
+
+NP_WINDOW = 30  # s
+MAX_GAP = 10.0  # s, longer holes in the recording are pauses
+
+# Resample a power stream (time in seconds, watts) to 1 Hz. Samples without a
+# time or power value are ignored. Returns the power for every second of
+# riding; gaps up to max_gap seconds are filled with the previous value and
+# longer ones are dropped.
+def resample_power(time, power, max_gap=MAX_GAP):
+    time = np.asarray(time, dtype=float)
+    power = np.asarray(power, dtype=float)
+    valid = np.isfinite(time) & np.isfinite(power)
+    time = time[valid]
+    power = power[valid]
+    if len(time) == 0:
+        return np.zeros(0)
+    if np.any(np.diff(time) < 0):
+        order = np.argsort(time, kind="stable")
+        time = time[order]
+        power = power[order]
+
+    # Average the samples that fall in the same second
+    second = np.floor(time - time[0]).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(second)) + 1))
+    counts = np.diff(np.append(starts, len(second)))
+    mean_power = np.add.reduceat(power, starts) / counts
+    second = second[starts]
+
+    # Close pauses to a single second, then forward-fill the remaining holes
+    gaps = np.diff(second)
+    position = np.concatenate(([0], np.cumsum(np.where(gaps > max_gap, 1, gaps))))
+    source = np.zeros(position[-1] + 1, dtype=np.int64)
+    source[position] = np.arange(len(position))
+    np.maximum.accumulate(source, out=source)
+    return mean_power[source]
+
+# Trailing mean over window samples from the difference of cumulative sums;
+# returns len(values) - window + 1 values
+def rolling_mean(values, window):
+    cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=float)))
+    return (cumulative[window:] - cumulative[:-window]) / window
+
+# Normalized power of a 1 Hz power stream: fourth-power mean of the 30 s
+# rolling average. Rides shorter than the window use the plain average.
+def calculate_normalized_power(power, window=NP_WINDOW):
+    power = np.asarray(power, dtype=float)
+    if len(power) == 0:
+        return 0.0
+    rolling = rolling_mean(power, min(window, len(power)))
+    return float(np.mean(rolling**4) ** 0.25)
+
+# Average power, normalized power, intensity factor, TSS and riding time (s)
+# of a recorded ride
+def ride_power_metrics(time, power, ftp, max_gap=MAX_GAP):
+    power = resample_power(time, power, max_gap)
+    riding_seconds = len(power)
+    avg_power = float(power.mean()) if riding_seconds else 0.0
+    normalized_power = calculate_normalized_power(power)
+    intensity = calculate_intensity_factor(normalized_power, ftp)
+    tss = calculate_tss(riding_seconds, normalized_power, ftp)
+    return avg_power, normalized_power, intensity, tss, riding_seconds
+
+# Best average power over a window of duration samples, for every duration in
+# durations, from one prefix-sum difference per duration (O(n) each)
+def _best_average(cumulative, durations):
+    return np.array([np.max(cumulative[d:] - cumulative[:-d]) / d for d in durations])
+
+# Mean-maximal power curve of a 1 Hz power stream: the best average power for
+# each duration on a log-spaced grid of about points_per_decade durations per
+# factor of ten, from 1 s to the whole ride. With refine, extra durations are
+# evaluated between grid points until neighbouring values differ by at most
+# tol watts or the durations are adjacent, which fills in the steep short
+# end of the curve where the log grid alone is coarsest. Returns
+# (duration_s, power).
+def mean_max_power(power, points_per_decade=20, refine=False, tol=1.0):
+    power = np.asarray(power, dtype=float)
+    n = len(power)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+
+    decades = np.log10(n)
+    durations = np.unique(np.round(np.logspace(0, decades, max(2, int(np.ceil(decades * points_per_decade)) + 1))))
+    durations = durations.astype(np.int64)
+    best = _best_average(cumulative, durations)
+
+    while refine:
+        split = (np.diff(durations) > 1) & (np.abs(np.diff(best)) > tol)
+        if not split.any():
+            break
+        middle = (durations[:-1][split] + durations[1:][split]) // 2
+        durations = np.concatenate((durations, middle))
+        best = np.concatenate((best, _best_average(cumulative, middle)))
+        order = np.argsort(durations)
+        durations = durations[order]
+        best = best[order]
+
+    return durations, best
+
+# FTP estimate from a mean-maximal power curve: 95% of the best 20 minute
+# power. Returns None for rides shorter than 20 minutes.
+def estimate_ftp(durations, power, test_duration=1200, factor=0.95):
+    if len(durations) == 0 or durations[-1] < test_duration:
+        return None
+    return factor * float(np.interp(test_duration, durations, power))
@@ -0,0 +1,64 @@
+"""Monte Carlo finish times under uncertain inputs.
+
+Power, CdA, Crr, wind and temperature are drawn from normal distributions
+and every draw is ridden over the course with one vectorized speed solve per
+chunk of draws. A long course is first reduced to a few grade bins (see
+bin_course) so the work per draw stays small.
+"""
+import numpy as np
+
+from bikecalc.physics import calculate_air_density, calculate_speed_batch
+
+DRAWS = 100_000
+CHUNK_ELEMENTS = 2_000_000  # draws x segments solved per call
+GRADE_BINS = 24
+
+# Reduce a segmented course to at most `bins` segments of similar grade. Each
+# bin keeps the total length and the length-weighted mean grade and altitude
+# of its segments, so the finish time at steady power barely changes.
+# Returns (segment_length, grade, altitude).
+def bin_course(segment_length, grade, altitude, bins=GRADE_BINS):
+    segment_length = np.asarray(segment_length, dtype=float)
+    grade = np.asarray(grade, dtype=float)
+    altitude = np.broadcast_to(np.asarray(altitude, dtype=float), grade.shape)
+    if len(grade) <= bins:
+        return segment_length, grade, altitude
+
+    edges = np.linspace(grade.min(), grade.max(), bins + 1)
+    index = np.clip(np.searchsorted(edges, grade, side="right") - 1, 0, bins - 1)
+    length = np.bincount(index, weights=segment_length, minlength=bins)
+    used = length > 0
+    mean_grade = np.bincount(index, weights=segment_length * grade, minlength=bins)[used] / length[used]
+    mean_altitude = np.bincount(index, weights=segment_length * altitude, minlength=bins)[used] / length[used]
+    return length[used], mean_grade, mean_altitude
+
+# Finish times (s) of `draws` rides over a segmented course. Each draw takes
+# its own sustainable power, CdA, Crr, wind (+ headwind) and temperature from
+# normal distributions around the given values with the given standard
+# deviations (power_sd as a fraction of power); draws are clipped to
+# physical values. The same seed gives the same times.
+def sample_finish_times(segment_length, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                        drivetrain_efficiency, power_sd=0.0, cda_sd=0.0, crr_sd=0.0, wind_sd_ms=0.0, temperature_sd=0.0,
+                        draws=DRAWS, seed=0, chunk_elements=CHUNK_ELEMENTS):
+    segment_length = np.atleast_1d(np.asarray(segment_length, dtype=float))
+    grade = np.broadcast_to(np.asarray(grade, dtype=float), segment_length.shape)
+    altitude = np.broadcast_to(np.asarray(altitude, dtype=float), segment_length.shape)
+
+    rng = np.random.default_rng(seed)
+    draw_power = np.maximum(rng.normal(power, power * power_sd, draws), 1.0)
+    draw_cda = np.maximum(rng.normal(cda, cda_sd, draws), 0.05)
+    draw_crr = np.maximum(rng.normal(crr, crr_sd, draws), 0.0005)
+    draw_wind = rng.normal(wind_speed_ms, wind_sd_ms, draws)
+    draw_temperature = rng.normal(temperature, temperature_sd, draws)
+
+    times = np.empty(draws)
+    chunk = max(1, chunk_elements // len(segment_length))
+    for start in range(0, draws, chunk):
+        part = slice(start, min(start + chunk, draws))
+        air_density = calculate_air_density(draw_temperature[part, None], altitude[None, :])
+        speed_ms = calculate_speed_batch(draw_power[part, None], total_weight, grade[None, :], draw_cda[part, None],
+                                         draw_crr[part, None], draw_wind[part, None], air_density,
+                                         drivetrain_efficiency)
+        with np.errstate(divide="ignore"):
+            times[part] = (segment_length / speed_ms).sum(axis=1)
+    return times
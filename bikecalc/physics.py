@@ -0,0 +1,349 @@
+"""Cycling power/speed physics shared by the Streamlit app and batch tools.
+
+Only NumPy is imported here so the module loads quickly in worker and API
+processes that never touch the UI.
+"""
+import math
+
+import numpy as np
+
+# Constants
+AIR_DENSITY_SEA_LEVEL = 1.225  # kg/m³
+GRAVITY = 9.8067  # m/s²
+
+# Simple model: air_density = AIR_DENSITY_SEA_LEVEL * exp(-altitude/8000) * (273/(273+temperature))
+def calculate_air_density(temperature, altitude):
+    return AIR_DENSITY_SEA_LEVEL * np.exp(np.asarray(altitude, dtype=float) / -8000) * (273 / (273 + np.asarray(temperature, dtype=float)))
+
+# Power required to ride at speed_ms; returns (power, f_rolling, f_grade, f_air)
+def calculate_power(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
+    # Speed relative to air (accounting for wind)
+    relative_speed_ms = speed_ms + wind_speed_ms
+
+    # Rolling resistance force
+    f_rolling = total_weight * GRAVITY * crr * math.cos(math.atan(grade/100))
+
+    # Grade resistance force
+    f_grade = total_weight * GRAVITY * math.sin(math.atan(grade/100))
+
+    # Air resistance force
+    f_air = 0.5 * cda * air_density * relative_speed_ms * abs(relative_speed_ms)
+
+    # Total resistance force
+    f_total = f_rolling + f_grade + f_air
+
+    # Power required
+    power = f_total * speed_ms / (drivetrain_efficiency / 100)
+
+    return power, f_rolling, f_grade, f_air
+
+# Speed (m/s) reached with the given power at the pedals
+def calculate_speed(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+                    method="cubic", tol=1e-6, initial_speed=None):
+    # A single scenario is solved with math on plain floats; NumPy's per-call
+    # overhead would cost more than the solve itself
+    power_at_wheel = float(power) * float(drivetrain_efficiency) / 100
+    slope = float(grade) / 100
+    f_static = float(total_weight) * GRAVITY * (float(crr) + slope) / math.sqrt(1.0 + slope * slope)
+    k = float(cda) * float(air_density)
+    w = float(wind_speed_ms)
+
+    if method == "newton":
+        # Iterate to tol, optionally warm started (see calculate_speed_newton)
+        return _speed_halley(power_at_wheel, f_static, k, w, tol, 10.0 if initial_speed is None else float(initial_speed))
+    # Solve the power cubic directly (see calculate_speed_batch)
+    speed_ms = _speed_cubic(power_at_wheel, f_static, k, w)
+    if speed_ms is None:
+        speed_ms, _ = calculate_speed_newton(power_at_wheel, 0.0, 0.0, 1.0, 0.0, w, k, 100, tol=1e-9, f_static=f_static)
+    return float(speed_ms)
+
+# calculate_speed_batch for one scenario. Returns None where the closed form
+# does not apply, for the bracketed solver to handle.
+def _speed_cubic(power_at_wheel, f_static, k, w):
+    if k <= 0 or power_at_wheel <= 0:
+        return None
+    a = 0.5 * k
+    b = k * w
+    c = f_static + 0.5 * k * w * w
+    d = -power_at_wheel
+    shift = b / (3 * a)
+    p = (3 * a * c - b * b) / (3 * a * a)
+    q = (2 * b * b * b - 9 * a * b * c + 27 * a * a * d) / (27 * a * a * a)
+    disc = (q / 2)**2 + (p / 3)**3
+    if disc > 0:
+        sqrt_disc = math.sqrt(disc)
+        t = math.cbrt(-q / 2 + sqrt_disc) + math.cbrt(-q / 2 - sqrt_disc)
+    elif p < 0:
+        m = 2 * math.sqrt(-p / 3)
+        t = m * math.cos(math.acos(min(max(3 * q / (p * m), -1.0), 1.0)) / 3)
+    else:
+        t = 0.0
+    speed_ms = t - shift
+
+    f = ((a * speed_ms + b) * speed_ms + c) * speed_ms + d
+    df = (3 * a * speed_ms + 2 * b) * speed_ms + c
+    if df > 0:
+        speed_ms -= f / df
+    if not math.isfinite(speed_ms) or speed_ms <= 0 or speed_ms + w < 0:
+        return None
+    return speed_ms
+
+# calculate_speed_newton for one scenario, with the same bracket and steps
+def _speed_halley(power_at_wheel, f_static, k, w, tol, speed_ms, max_iterations=100):
+    power_at_wheel = max(power_at_wheel, 0.0)
+
+    def too_slow(v):
+        rel = v + w
+        return v * (f_static + 0.5 * k * rel * abs(rel)) <= power_at_wheel
+
+    # Bracket as in _bracket_speed
+    lo, hi = 0.0, 30.0
+    for _ in range(30):
+        if not too_slow(hi):
+            break
+        lo, hi = hi, hi * 2
+    else:
+        if too_slow(hi):
+            return math.inf
+    v = min(max(speed_ms, lo), hi)
+
+    for _ in range(max_iterations):
+        rel = v + w
+        sign = -1.0 if rel < 0 else 1.0
+        f = v * (f_static + 0.5 * k * rel * abs(rel)) - power_at_wheel
+        if f == 0:
+            return v
+        df = f_static + 0.5 * k * sign * (rel * rel + 2 * v * rel)
+        d2f = k * sign * (3 * v + 2 * w)
+        if f < 0:
+            lo = v
+        else:
+            hi = v
+
+        denominator = 2 * df * df - f * d2f
+        step = 2 * f * df / denominator if denominator else math.inf
+        v_new = v - step
+        if abs(step) < tol:
+            return v_new
+        if not math.isfinite(v_new) or v_new < lo or v_new > hi:
+            v_new = (lo + hi) / 2
+        v = v_new
+        if hi - lo < tol:
+            break
+    return v
+
+# Vectorized version of calculate_power. Every argument may be a
+# scalar or a NumPy array; arrays are broadcast against each other so a whole
+# batch of scenarios is evaluated in a handful of array operations.
+def calculate_power_batch(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
+    speed_ms = np.asarray(speed_ms, dtype=float)
+    total_weight = np.asarray(total_weight, dtype=float)
+    slope = np.asarray(grade, dtype=float) / 100
+    cda = _as_float_array(cda)
+    crr = _as_float_array(crr)
+    wind_speed_ms = _as_float_array(wind_speed_ms)
+    air_density = _as_float_array(air_density)
+
+    # cos(atan(x)) and sin(atan(x)) without the trig calls
+    inv_hyp = 1.0 / np.sqrt(1.0 + slope**2)
+
+    # Speed relative to air (accounting for wind); drag pushes the rider
+    # forward when a tailwind is faster than the rider
+    relative_speed_ms = speed_ms + wind_speed_ms
+
+    # Rolling, grade and air resistance forces
+    f_rolling = total_weight * GRAVITY * crr * inv_hyp
+    f_grade = total_weight * GRAVITY * slope * inv_hyp
+    f_air = 0.5 * cda * air_density * relative_speed_ms * np.abs(relative_speed_ms)
+
+    # Power required
+    power = (f_rolling + f_grade + f_air) * speed_ms / (np.asarray(drivetrain_efficiency, dtype=float) / 100)
+
+    return power, f_rolling, f_grade, f_air
+
+# np.asarray for sequences; plain numbers are left as they are, since 0-d
+# arrays make every product with them a ufunc call
+def _as_float_array(x):
+    return x if isinstance(x, (int, float)) else np.asarray(x, dtype=float)
+
+# Speed from power in closed form. With constant wind and the air coming from
+# ahead (v + w >= 0) the power at the wheel
+#   P = (f_rolling + f_grade) * v + 0.5 * cda * rho * (v + w)**2 * v
+# is a cubic in the ground speed v, so every scenario in the batch is solved
+# exactly with Cardano's formula (trigonometric form when there are three real
+# roots) instead of 50 bisection steps. Scenarios the closed form does not
+# cover (no air drag, a tailwind faster than the rider, coasting) go through
+# the bracketed solver in calculate_speed_newton. max_speed caps the result,
+# e.g. for braking on descents.
+def calculate_speed_batch(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+                          max_speed=None):
+    power_at_wheel = np.asarray(power, dtype=float) * (np.asarray(drivetrain_efficiency, dtype=float) / 100)
+
+    # Speed independent resistance and the air drag coefficient
+    _, f_rolling, f_grade, _ = calculate_power_batch(0.0, total_weight, grade, cda, crr, 0.0, air_density, 100)
+    f_static = f_rolling + f_grade
+    k = np.asarray(cda, dtype=float) * np.asarray(air_density, dtype=float)
+    w = np.asarray(wind_speed_ms, dtype=float)
+
+    power_at_wheel, f_static, k, w = np.broadcast_arrays(power_at_wheel, f_static, k, w)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # a v³ + b v² + c v + d = 0, substituted v = t - b/(3a) into t³ + p t + q = 0
+        a = 0.5 * k
+        b = k * w
+        c = f_static + 0.5 * k * w**2
+        d = -power_at_wheel
+        shift = b / (3 * a)
+        p = (3 * a * c - b**2) / (3 * a**2)
+        q = (2 * b**3 - 9 * a * b * c + 27 * a**2 * d) / (27 * a**3)
+        disc = (q / 2)**2 + (p / 3)**3
+
+        # One real root
+        sqrt_disc = np.sqrt(np.where(disc > 0, disc, 0.0))
+        t_one = np.cbrt(-q / 2 + sqrt_disc) + np.cbrt(-q / 2 - sqrt_disc)
+
+        # Three real roots, take the largest
+        m = 2 * np.sqrt(np.where(p < 0, -p / 3, 0.0))
+        arg = np.clip(3 * q / (p * m), -1.0, 1.0)
+        t_three = m * np.cos(np.arccos(arg) / 3)
+
+        speed_ms = np.where(disc > 0, t_one, t_three) - shift
+
+        # One Newton step to clean up cancellation in the closed form
+        f = ((a * speed_ms + b) * speed_ms + c) * speed_ms + d
+        df = (3 * a * speed_ms + 2 * b) * speed_ms + c
+        speed_ms = np.where(df > 0, speed_ms - f / df, speed_ms)
+
+    # Power is strictly increasing in speed above zero, so a positive root with
+    # the air coming from ahead is the only one. Everything else is bracketed.
+    bad = ~np.isfinite(speed_ms) | (speed_ms <= 0) | (speed_ms + w < 0) | (k <= 0) | (power_at_wheel <= 0)
+    if np.any(bad):
+        speed_ms = np.array(speed_ms, dtype=float)
+        speed_ms[bad], _ = calculate_speed_newton(power_at_wheel[bad], 0.0, 0.0, 1.0, 0.0, w[bad], k[bad], 100,
+                                                  tol=1e-9, f_static=f_static[bad])
+
+    if max_speed is not None:
+        speed_ms = np.minimum(speed_ms, max_speed)
+
+    return speed_ms
+
+# Iterative alternative to calculate_speed_batch. Halley steps on the power
+# curve using its analytic first and second derivative, safeguarded by a
+# bracket that shrinks every iteration: a step that would leave the bracket is
+# replaced by bisection. Iteration stops per scenario once the step is below
+# tol (m/s). A warm start (e.g. the previous segment's speed on a course)
+# usually converges in 2-3 iterations. Returns (speed_ms, iterations) where
+# iterations holds the per-scenario iteration count. f_static overrides the
+# rolling + grade force computed from the rider inputs.
+def calculate_speed_newton(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+                           tol=1e-6, initial_speed=None, max_iterations=100, max_speed=None, f_static=None):
+    power_at_wheel = np.asarray(power, dtype=float) * (np.asarray(drivetrain_efficiency, dtype=float) / 100)
+
+    if f_static is None:
+        _, f_rolling, f_grade, _ = calculate_power_batch(0.0, total_weight, grade, cda, crr, 0.0, air_density, 100)
+        f_static = f_rolling + f_grade
+    k = np.asarray(cda, dtype=float) * np.asarray(air_density, dtype=float)
+    w = np.asarray(wind_speed_ms, dtype=float)
+    if initial_speed is None:
+        initial_speed = 10.0
+    power_at_wheel, f_static, k, w, speed_ms = np.broadcast_arrays(np.maximum(power_at_wheel, 0.0), f_static, k, w,
+                                                                   np.asarray(initial_speed, dtype=float))
+    shape = speed_ms.shape
+    power_at_wheel, f_static, k, w = power_at_wheel.ravel(), f_static.ravel(), k.ravel(), w.ravel()
+    speed_ms = speed_ms.flatten()
+
+    speed_min, speed_max = _bracket_speed(power_at_wheel, f_static, k, w, max_speed)
+    speed_ms = np.clip(speed_ms, speed_min, speed_max)
+    iterations = np.zeros(speed_ms.shape, dtype=int)
+    active = np.isfinite(speed_max) & (speed_max > speed_min)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        v = speed_ms[active]
+        ff, kk, ww = f_static[active], k[active], w[active]
+        lo, hi = speed_min[active], speed_max[active]
+
+        # Power at the wheel with the air drag sign following the relative wind
+        rel = v + ww
+        sign = np.where(rel < 0, -1.0, 1.0)
+        f = v * (ff + 0.5 * kk * rel * np.abs(rel)) - power_at_wheel[active]
+        df = ff + 0.5 * kk * sign * (rel**2 + 2 * v * rel)
+        d2f = kk * sign * (3 * v + 2 * ww)
+
+        # Shrink the bracket with the sign of the residual
+        lo = np.where(f < 0, v, lo)
+        hi = np.where(f > 0, v, hi)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = 2 * f * df / (2 * df**2 - f * d2f)
+        v_new = v - step
+
+        # A step below tol has converged even if rounding put v on the bracket
+        # edge; only an unconverged step that leaves the bracket is bisected
+        converged = (np.abs(step) < tol) | (f == 0)
+        outside = ~converged & (~np.isfinite(v_new) | (v_new < lo) | (v_new > hi))
+        v_new = np.where(outside, (lo + hi) / 2, v_new)
+
+        done = converged | (hi - lo < tol)
+        speed_ms[active] = np.where(f == 0, v, v_new)
+        speed_min[active] = lo
+        speed_max[active] = hi
+        iterations[active] += 1
+        active[active] = ~done
+
+    return speed_ms.reshape(shape), iterations.reshape(shape)
+
+# Bracket [speed_min, speed_max] around the speed where the power at the wheel
+# matches. The upper end starts at 30 m/s and doubles until it is too fast,
+# which covers steep descents and strong tailwinds. Without air drag there may
+# be no upper end at all (speed_max = inf); with max_speed the bracket stops
+# there and speed_min = speed_max = max_speed means the rider is braking.
+def _bracket_speed(power_at_wheel, f_static, k, w, max_speed=None, max_doublings=30):
+    speed_min = np.zeros(power_at_wheel.shape)  # m/s
+    speed_max = np.full(power_at_wheel.shape, 30.0)  # m/s
+    if max_speed is not None:
+        speed_max = np.minimum(speed_max, max_speed)
+
+    def too_slow(v):
+        rel = v + w
+        return v * (f_static + 0.5 * k * rel * np.abs(rel)) <= power_at_wheel
+
+    expand = too_slow(speed_max)
+    for _ in range(max_doublings):
+        if max_speed is not None:
+            expand &= speed_max < max_speed
+        if not expand.any():
+            break
+        speed_min = np.where(expand, speed_max, speed_min)
+        speed_max = np.where(expand, speed_max * 2, speed_max)
+        if max_speed is not None:
+            speed_max = np.minimum(speed_max, max_speed)
+        expand = too_slow(speed_max)
+
+    if max_speed is not None:
+        # Capped scenarios: hold the cap
+        capped = (speed_max >= max_speed) & too_slow(speed_max)
+        speed_min = np.where(capped, speed_max, speed_min)
+    else:
+        # Still accelerating after all doublings: no drag to stop the rider
+        speed_max = np.where(expand, np.inf, speed_max)
+        speed_min = np.where(expand, np.inf, speed_min)
+
+    return speed_min, speed_max
+
+# Intensity factor: normalized power relative to FTP
+def calculate_intensity_factor(normalized_power, ftp):
+    return normalized_power / ftp if ftp > 0 else 0
+
+# Training stress score for a ride of total_seconds at normalized_power
+def calculate_tss(total_seconds, normalized_power, ftp):
+    return (total_seconds / 3600) * (normalized_power / ftp) ** 2 * 100 if ftp > 0 else 0
+
+# Format a duration in seconds as HH:MM:SS
+def format_time(total_seconds):
+    total_seconds = int(total_seconds)
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,72 @@
+"""Critical power model and the power a rider can hold for a given event.
+
+Up to an hour the two-parameter model P(t) = CP + W' / t is used. Beyond
+that it overestimates how far the power curve flattens out, so power then
+decays as a power law of duration, like Riegel's endurance formula for
+running times.
+"""
+import numpy as np
+
+from bikecalc.course import simulate_course
+from bikecalc.physics import calculate_speed_batch
+
+FIT_MIN_DURATION = 120  # s
+FIT_MAX_DURATION = 1200  # s
+LONG_DURATION = 3600  # s, where the long-duration decay takes over
+ENDURANCE_EXPONENT = 0.07
+
+# Fit CP (W) and W' (J) to a mean-maximal power curve. Over the 2-20 minute
+# range the work done, P * t, is linear in t with slope CP and intercept W'.
+# Returns (cp, w_prime).
+def fit_critical_power(durations, power, min_duration=FIT_MIN_DURATION, max_duration=FIT_MAX_DURATION):
+    durations = np.asarray(durations, dtype=float)
+    power = np.asarray(power, dtype=float)
+    in_range = (durations >= min_duration) & (durations <= max_duration)
+    if np.count_nonzero(in_range) < 2:
+        raise ValueError("Critical power needs efforts between 2 and 20 minutes")
+    cp, w_prime = np.polyfit(durations[in_range], power[in_range] * durations[in_range], 1)
+    return float(cp), float(max(w_prime, 0.0))
+
+# Power that can be held for duration seconds (scalar or array)
+def sustainable_power(duration, cp, w_prime, long_duration=LONG_DURATION, endurance_exponent=ENDURANCE_EXPONENT):
+    duration = np.asarray(duration, dtype=float)
+    with np.errstate(divide="ignore"):
+        short = cp + w_prime / duration
+    long = (cp + w_prime / long_duration) * (duration / long_duration) ** -endurance_exponent
+    return np.where(duration <= long_duration, short, long)
+
+# Power for a ride of distance_m metres (scalar or array) that lasts exactly
+# as long as the model allows that power to be held. The finish time is found
+# by fixed-point iteration t -> distance / speed(sustainable_power(t)), which
+# converges quickly because power changes slowly with duration. Returns
+# (power, speed_ms, time_s).
+def race_power(distance_m, cp, w_prime, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+               tol=1e-9, max_iterations=100):
+    distance_m = np.asarray(distance_m, dtype=float)
+    time = distance_m / 10.0
+    for _ in range(max_iterations):
+        power = sustainable_power(time, cp, w_prime)
+        speed_ms = calculate_speed_batch(power, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                                         drivetrain_efficiency)
+        new_time = distance_m / speed_ms
+        converged = np.all(np.abs(new_time - time) <= tol * new_time)
+        time = new_time
+        if converged:
+            break
+    return power, speed_ms, time
+
+# The same fixed point over a segmented course (see bikecalc.course.simulate_course).
+# Returns (power, speed_ms, segment_time_s).
+def course_race_power(segment_length, grade, altitude, cp, w_prime, total_weight, cda, crr, wind_speed_ms, temperature,
+                      drivetrain_efficiency, tol=1e-9, max_iterations=100):
+    time = np.sum(segment_length) / 10.0
+    for _ in range(max_iterations):
+        power = float(sustainable_power(time, cp, w_prime))
+        speed_ms, segment_time = simulate_course(segment_length, grade, altitude, power, total_weight, cda, crr,
+                                                 wind_speed_ms, temperature, drivetrain_efficiency)
+        new_time = float(segment_time.sum())
+        converged = abs(new_time - time) <= tol * new_time
+        time = new_time
+        if converged:
+            break
+    return power, speed_ms, segment_time
@@ -0,0 +1,424 @@
+"""Streaming reader for FIT, TCX and GPX ride and route files.
+
+Files are read block by block and decoded into fixed-size chunks of NumPy
+arrays, so memory stays bounded however long the ride is. XML fields are
+matched with regular expressions over each block and FIT records are decoded
+with structured dtypes; neither builds an element tree or a Python object per
+data point.
+"""
+import re
+
+import numpy as np
+
+# Columns of every chunk: seconds since the Unix epoch, metres, metres, watts,
+# bpm, rpm, m/s, degrees, degrees. Missing values are NaN.
+RIDE_FIELDS = ("time", "distance", "altitude", "power", "heart_rate", "cadence", "speed", "lat", "lon")
+
+CHUNK_SIZE = 65536  # points per chunk
+BLOCK_SIZE = 1 << 20  # bytes read per block
+
+EARTH_RADIUS = 6371008.8  # m
+
+# Yield chunks of at most chunk_size points from an open binary file. Each
+# chunk is a dict of float arrays keyed by RIDE_FIELDS (or by fields, to
+# decode only some columns). fmt is "fit", "tcx" or "gpx"; by default it is
+# detected from the start of the file.
+def iter_ride_chunks(fileobj, chunk_size=CHUNK_SIZE, fields=None, fmt=None):
+    fields = tuple(RIDE_FIELDS if fields is None else fields)
+    head = fileobj.read(4096)
+    if fmt is None:
+        fmt = detect_format(head)
+
+    if fmt == "fit":
+        batches = _iter_fit(fileobj, head, fields)
+    else:
+        batches = _iter_xml(fileobj, head, fmt, fields)
+    yield from _rechunk(batches, fields, chunk_size)
+
+# Read a whole ride into one dict of arrays (see iter_ride_chunks)
+def read_ride(fileobj, fields=None, fmt=None):
+    fields = tuple(RIDE_FIELDS if fields is None else fields)
+    chunks = list(iter_ride_chunks(fileobj, fields=fields, fmt=fmt))
+    if not chunks:
+        return {name: np.zeros(0) for name in fields}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in fields}
+
+# Work out the file format from its first bytes
+def detect_format(head):
+    head = bytes(head)
+    if len(head) >= 12 and head[8:12] == b".FIT":
+        return "fit"
+    if b"TrainingCenterDatabase" in head:
+        return "tcx"
+    if re.search(rb"<(?:\w+:)?gpx\b", head):
+        return "gpx"
+    raise ValueError("Unrecognised ride file: expected FIT, TCX or GPX")
+
+# Regroup variable-size batches into chunks of exactly chunk_size points
+# (the last one may be shorter)
+def _rechunk(batches, fields, chunk_size):
+    pending = []
+    pending_size = 0
+    for batch in batches:
+        size = len(batch[fields[0]]) if fields else 0
+        if size == 0:
+            continue
+        pending.append(batch)
+        pending_size += size
+        while pending_size >= chunk_size:
+            merged = {name: np.concatenate([b[name] for b in pending]) for name in fields}
+            yield {name: values[:chunk_size] for name, values in merged.items()}
+            pending = [{name: values[chunk_size:] for name, values in merged.items()}]
+            pending_size -= chunk_size
+    if pending_size:
+        yield {name: np.concatenate([b[name] for b in pending]) for name in fields}
+
+# Cumulative distance continuing from the previous block. carry holds the
+# last known position and distance; gaps in the position add nothing.
+def _distance_from_positions(lat, lon, carry):
+    lat = np.concatenate(([carry["lat"]], lat))
+    lon = np.concatenate(([carry["lon"]], lon))
+    known = np.isfinite(lat) & np.isfinite(lon)
+    # Hold the last known position through gaps
+    index = np.maximum.accumulate(np.where(known, np.arange(len(lat)), 0))
+    lat = np.radians(lat[index])
+    lon = np.radians(lon[index])
+    h = np.sin(np.diff(lat) / 2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2)**2
+    steps = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    distance = carry["distance"] + np.cumsum(np.nan_to_num(steps))
+    carry["lat"] = np.degrees(lat[-1])
+    carry["lon"] = np.degrees(lon[-1])
+    if len(distance):
+        carry["distance"] = distance[-1]
+    return distance
+
+# Keep the recorded distance of a block, or integrate it from the positions
+# when the block has none. Either way carry follows along.
+def _fill_distance(points, carry):
+    recorded = points.get("distance")
+    derived = _distance_from_positions(points["lat"], points["lon"], carry)
+    if recorded is not None and np.isfinite(recorded).any():
+        if np.isfinite(recorded[-1]):
+            carry["distance"] = recorded[-1]
+    else:
+        points["distance"] = derived
+
+
+# ---------------------------------------------------------------------------
+# GPX / TCX
+
+# Track point element names and per-field patterns for each XML format. Every
+# pattern starts with a literal so the regex engine scans each block quickly;
+# closing tags never match because a value must follow.
+_NUMBER = rb">\s*([-+0-9.eE]+)"
+_TIMESTAMP = rb">\s*(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)"
+_XML_FORMATS = {
+    "gpx": ((b"trkpt", b"rtept"), {
+        "time": rb"time" + _TIMESTAMP,
+        "altitude": rb"ele" + _NUMBER,
+        "power": rb"(?:power|PowerInWatts)" + _NUMBER,
+        "heart_rate": rb"hr" + _NUMBER,
+        "cadence": rb"cad" + _NUMBER,
+        "speed": rb"speed" + _NUMBER,
+        "lat": rb"lat\s*=\s*[\"']([-+0-9.eE]+)",
+        "lon": rb"lon\s*=\s*[\"']([-+0-9.eE]+)",
+    }),
+    "tcx": ((b"Trackpoint",), {
+        "time": rb"Time" + _TIMESTAMP,
+        "distance": rb"DistanceMeters" + _NUMBER,
+        "altitude": rb"AltitudeMeters" + _NUMBER,
+        "power": rb"Watts" + _NUMBER,
+        "heart_rate": rb"HeartRateBpm[^>]*>\s*<(?:\w+:)?Value" + _NUMBER,
+        "cadence": rb"Cadence" + _NUMBER,
+        "speed": rb"Speed" + _NUMBER,
+        "lat": rb"LatitudeDegrees" + _NUMBER,
+        "lon": rb"LongitudeDegrees" + _NUMBER,
+    }),
+}
+
+def _iter_xml(fileobj, head, fmt, fields):
+    point_tags, patterns = _XML_FORMATS[fmt]
+    # Distance missing from the file (always for GPX) is integrated from the
+    # positions, so those are read whenever distance is wanted
+    wanted = set(fields) | ({"lat", "lon"} if "distance" in fields else set())
+    patterns = {name: re.compile(pattern) for name, pattern in patterns.items() if name in wanted}
+    carry = {"lat": np.nan, "lon": np.nan, "distance": 0.0}
+
+    buffer = bytes(head)
+    while True:
+        block = fileobj.read(BLOCK_SIZE)
+        if block:
+            buffer += block
+            # Everything before the last point start holds only complete points
+            cut = _last_element_start(buffer, point_tags)
+            if cut <= 0:
+                continue
+            data, buffer = buffer[:cut], buffer[cut:]
+        else:
+            data, buffer = buffer, b""
+
+        points = _parse_points(data, point_tags, patterns)
+        if "distance" in fields:
+            _fill_distance(points, carry)
+        n = len(points["_start"])
+        yield {name: points.get(name, np.full(n, np.nan)) for name in fields}
+
+        if not block:
+            break
+
+# Offset of the '<' of the last opening tag named one of tags, or -1
+def _last_element_start(data, tags):
+    best = -1
+    for tag in tags:
+        end = len(data)
+        while True:
+            i = data.rfind(tag, 0, end)
+            if i <= 0:
+                break
+            lt = data.rfind(b"<", 0, i)
+            after = data[i + len(tag):i + len(tag) + 1]
+            if lt >= 0 and i - lt <= 32 and data[lt + 1:lt + 2] != b"/" and after in (b" ", b">", b"/", b"\t", b"\r", b"\n"):
+                best = max(best, lt)
+                break
+            end = i
+    return best
+
+# Start and end offsets of every element named one of tags (any namespace
+# prefix). Opening and closing tags are told apart by the byte after the '<'
+# that precedes each match, looked up for all matches at once.
+def _element_spans(data, tags):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    opens = np.flatnonzero(raw == ord("<"))
+    pattern = b"(?:" + b"|".join(tags) + rb")[\s>/]"
+    matches = np.fromiter(map(re.Match.start, re.finditer(pattern, data)), dtype=np.int64)
+    if len(matches) == 0 or len(opens) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    tag_open = opens[np.maximum(np.searchsorted(opens, matches) - 1, 0)]
+    # Only keep names that really are tag names: '<' then an optional prefix
+    is_tag = (matches - tag_open) <= 32
+    closing = raw[np.minimum(tag_open + 1, len(raw) - 1)] == ord("/")
+    starts = tag_open[is_tag & ~closing]
+    ends = matches[is_tag & closing]
+
+    # Self-closing elements end where they start
+    if len(ends) != len(starts):
+        self_closing = np.fromiter(map(re.Match.end, re.finditer(b"(?:" + b"|".join(tags) + rb")\b[^<>]*/>", data)),
+                                   dtype=np.int64)
+        ends = np.sort(np.concatenate((ends, self_closing)))
+    return starts, ends
+
+# Extract the fields of every point in data. Returns a dict of float arrays,
+# one entry per point, NaN where a point lacks the field; "_start" holds the
+# point offsets. Each field is matched over the whole block and handed to the
+# point whose element encloses it.
+def _parse_points(data, point_tags, patterns):
+    starts, ends = _element_spans(data, point_tags)
+
+    points = {"_start": starts}
+    for name, pattern in patterns.items():
+        column = np.full(len(starts), np.nan)
+        values = pattern.findall(data)
+        if values and len(starts):
+            positions = np.fromiter(map(re.Match.start, pattern.finditer(data)), dtype=np.int64)
+            if name == "time":
+                values = np.array(values).astype("datetime64[ms]").astype(np.int64) / 1000
+            else:
+                values = np.array(values).astype(float)
+            owner = np.searchsorted(starts, positions, side="right") - 1
+            inside = owner >= 0
+            if len(ends) == len(starts):
+                inside &= positions < ends[np.maximum(owner, 0)]
+            column[owner[inside]] = values[inside]
+        points[name] = column
+    return points
+
+
+# ---------------------------------------------------------------------------
+# FIT
+
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z in Unix seconds
+RECORD_MESSAGE = 20
+
+# FIT base type -> (NumPy type code, invalid value)
+_FIT_BASE_TYPES = {
+    0x00: ("u1", 0xFF), 0x01: ("i1", 0x7F), 0x02: ("u1", 0xFF),
+    0x83: ("i2", 0x7FFF), 0x84: ("u2", 0xFFFF), 0x85: ("i4", 0x7FFFFFFF),
+    0x86: ("u4", 0xFFFFFFFF), 0x88: ("f4", None), 0x89: ("f8", None),
+    0x0A: ("u1", 0x00), 0x8B: ("u2", 0x0000), 0x8C: ("u4", 0x00000000),
+    0x0D: ("u1", 0xFF), 0x8E: ("i8", 0x7FFFFFFFFFFFFFFF),
+    0x8F: ("u8", 0xFFFFFFFFFFFFFFFF), 0x90: ("u8", 0x0000000000000000),
+}
+
+# Record message field number -> (column, scale, offset); later entries win
+# when a message carries both, so the enhanced fields take priority
+_FIT_RECORD_FIELDS = {
+    253: ("time", 1, -FIT_EPOCH),
+    0: ("lat", 2**31 / 180, 0),
+    1: ("lon", 2**31 / 180, 0),
+    2: ("altitude", 5, 500),
+    78: ("altitude", 5, 500),
+    3: ("heart_rate", 1, 0),
+    4: ("cadence", 1, 0),
+    5: ("distance", 100, 0),
+    6: ("speed", 1000, 0),
+    73: ("speed", 1000, 0),
+    7: ("power", 1, 0),
+}
+_FIT_PRIORITY = (253, 0, 1, 2, 78, 3, 4, 5, 6, 73, 7)
+
+# One local message definition: its total size plus, for record messages, a
+# structured dtype that pulls the wanted fields out of the raw bytes
+class _FitDefinition:
+    def __init__(self, global_number, size, dtype, fields, timestamp_offset, endian):
+        self.global_number = global_number
+        self.size = size
+        self.dtype = dtype
+        self.fields = fields
+        self.timestamp_offset = timestamp_offset
+        self.endian = endian
+
+def _parse_fit_definition(data, pos, has_developer_fields):
+    endian = "big" if data[pos + 1] == 1 else "little"
+    prefix = ">" if endian == "big" else "<"
+    global_number = int.from_bytes(data[pos + 2:pos + 4], endian)
+    count = data[pos + 4]
+    pos += 5
+
+    names, formats, offsets, fields = [], [], [], []
+    size = 0
+    timestamp_offset = None
+    for i in range(count):
+        number, field_size, base_type = data[pos], data[pos + 1], data[pos + 2]
+        pos += 3
+        code, invalid = _FIT_BASE_TYPES.get(base_type, ("u1", None))
+        if (global_number == RECORD_MESSAGE and number in _FIT_RECORD_FIELDS
+                and np.dtype(code).itemsize == field_size):
+            names.append(f"f{number}")
+            formats.append(prefix + code)
+            offsets.append(size)
+            fields.append((number, invalid))
+            if number == 253:
+                timestamp_offset = size
+        size += field_size
+
+    if has_developer_fields:
+        dev_count = data[pos]
+        pos += 1
+        for i in range(dev_count):
+            size += data[pos + 1]
+            pos += 3
+
+    dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": max(size, 1)})
+    fields.sort(key=lambda field: _FIT_PRIORITY.index(field[0]))
+    return _FitDefinition(global_number, size, dtype, fields, timestamp_offset, endian), pos
+
+# Length of a definition message starting at pos, or None if data ends first
+def _fit_definition_length(data, pos, has_developer_fields):
+    if pos + 5 > len(data):
+        return None
+    length = 5 + 3 * data[pos + 4]
+    if has_developer_fields:
+        if pos + length + 1 > len(data):
+            return None
+        length += 1 + 3 * data[pos + length]
+    return length if pos + length <= len(data) else None
+
+def _iter_fit(fileobj, head, fields):
+    # Distance missing from the file is integrated from the positions, as for
+    # GPX and TCX
+    wanted = fields + tuple(name for name in ("lat", "lon") if "distance" in fields and name not in fields)
+    carry = {"lat": np.nan, "lon": np.nan, "distance": 0.0}
+    header_size = head[0]
+    data_size = int.from_bytes(head[4:8], "little")
+    buffer = bytes(head[header_size:])
+    remaining = data_size  # bytes of records left in the file
+    definitions = {}
+    last_timestamp = 0
+
+    while True:
+        # Top up the buffer; records past the data section (the CRC) are dropped
+        block = fileobj.read(BLOCK_SIZE) if len(buffer) < remaining else b""
+        buffer += block
+        data = buffer[:remaining]
+        end = len(data)
+        final = len(buffer) >= remaining or not block
+
+        # Walk the record headers. Only offsets are collected here; the field
+        # values are decoded below, all records of a definition at once.
+        record_offsets = {}
+        compressed_times = {}
+        pos = 0
+        while pos < end:
+            header = data[pos]
+            if header & 0x80:
+                # Compressed timestamp header
+                definition = definitions.get((header >> 5) & 0x03)
+                if definition is None or pos + 1 + definition.size > end:
+                    break
+                offset = header & 0x1F
+                last_timestamp += (offset - last_timestamp) & 0x1F
+                if definition.global_number == RECORD_MESSAGE:
+                    record_offsets.setdefault(id(definition), (definition, []))[1].append(pos + 1)
+                    compressed_times.setdefault(id(definition), {})[len(record_offsets[id(definition)][1]) - 1] = last_timestamp
+                pos += 1 + definition.size
+            elif header & 0x40:
+                length = _fit_definition_length(data, pos + 1, header & 0x20)
+                if length is None:
+                    break
+                definitions[header & 0x0F], _ = _parse_fit_definition(data, pos + 1, header & 0x20)
+                pos += 1 + length
+            else:
+                definition = definitions.get(header & 0x0F)
+                if definition is None:
+                    raise ValueError("FIT data message without a definition")
+                if pos + 1 + definition.size > end:
+                    break
+                if definition.timestamp_offset is not None:
+                    start = pos + 1 + definition.timestamp_offset
+                    last_timestamp = int.from_bytes(data[start:start + 4], definition.endian)
+                if definition.global_number == RECORD_MESSAGE:
+                    record_offsets.setdefault(id(definition), (definition, []))[1].append(pos + 1)
+                pos += 1 + definition.size
+
+        points = _decode_fit_records(data, record_offsets, compressed_times, wanted)
+        if "distance" in fields:
+            _fill_distance(points, carry)
+        yield {name: points[name] for name in fields}
+
+        buffer = buffer[pos:]
+        remaining -= pos
+        if final and (pos == 0 or remaining <= 0):
+            break
+
+# Decode the collected record messages of one block into columns, in file order
+def _decode_fit_records(data, record_offsets, compressed_times, fields):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    order, columns = [], {name: [] for name in fields}
+    for key, (definition, offsets) in record_offsets.items():
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n = len(offsets)
+        # Gather each record's bytes into one row and view them with the dtype
+        rows = raw[offsets[:, None] + np.arange(definition.size)]
+        records = np.ascontiguousarray(rows).view(definition.dtype).reshape(n)
+
+        values = {name: np.full(n, np.nan) for name in fields}
+        for number, invalid in definition.fields:
+            name, scale, offset = _FIT_RECORD_FIELDS[number]
+            if name not in values:
+                continue
+            column = records[f"f{number}"]
+            valid = column != invalid if invalid is not None else np.isfinite(column)
+            values[name] = np.where(valid, column / scale - offset, values[name])
+        if key in compressed_times and "time" in values:
+            index = np.fromiter(compressed_times[key].keys(), dtype=np.int64)
+            values["time"][index] = np.fromiter(compressed_times[key].values(), dtype=float) + FIT_EPOCH
+
+        order.append(offsets)
+        for name in fields:
+            columns[name].append(values[name])
+
+    if not order:
+        return {name: np.zeros(0) for name in fields}
+    sort = np.argsort(np.concatenate(order), kind="stable")
+    return {name: np.concatenate(columns[name])[sort] for name in fields}
@@ -0,0 +1,75 @@
+"""Analytic sensitivities of steady-state power, speed and finish time.
+
+The power model of bikecalc.physics is differentiated by hand, so every
+partial derivative comes from the same single solve as the result itself.
+Speed at a given power is defined implicitly by P(v, θ) = power; the implicit
+function theorem gives
+
+    dv/dθ = -(∂P/∂θ) / (∂P/∂v)
+
+and the finish time T = distance / v follows with dT/dθ = -T / v * dv/dθ.
+Grade is in percent and drivetrain efficiency in percent, as everywhere else.
+"""
+import numpy as np
+
+from bikecalc.physics import GRAVITY, calculate_power_batch, calculate_speed_batch
+
+# Inputs of calculate_power / calculate_speed that have a sensitivity, in the
+# order of their arguments
+SENSITIVITY_INPUTS = ("total_weight", "grade", "cda", "crr", "wind_speed_ms", "air_density", "drivetrain_efficiency")
+
+# Partial derivatives of the power required at speed_ms. Returns (∂P/∂v, dict
+# of ∂P/∂θ keyed by SENSITIVITY_INPUTS); arguments broadcast like
+# calculate_power_batch.
+def power_partials(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
+    speed_ms = np.asarray(speed_ms, dtype=float)
+    total_weight = np.asarray(total_weight, dtype=float)
+    slope = np.asarray(grade, dtype=float) / 100
+    cda = np.asarray(cda, dtype=float)
+    crr = np.asarray(crr, dtype=float)
+    air_density = np.asarray(air_density, dtype=float)
+    efficiency = np.asarray(drivetrain_efficiency, dtype=float) / 100
+
+    power, f_rolling, f_grade, f_air = calculate_power_batch(speed_ms, total_weight, grade, cda, crr, wind_speed_ms,
+                                                              air_density, drivetrain_efficiency)
+    relative_speed_ms = speed_ms + wind_speed_ms
+    # (v + w)|v + w| per unit drag coefficient, and its derivative 2|v + w|
+    drag_term = relative_speed_ms * np.abs(relative_speed_ms)
+    k = cda * air_density
+
+    inv_hyp = 1.0 / np.sqrt(1.0 + slope**2)
+    scale = speed_ms / efficiency
+    partials = {
+        "total_weight": GRAVITY * (crr + slope) * inv_hyp * scale,
+        # d/dslope of (crr cos + sin)(atan slope) is (1 - crr slope) / (1 + slope²)^1.5
+        "grade": total_weight * GRAVITY * (1 - crr * slope) * inv_hyp**3 / 100 * scale,
+        "cda": 0.5 * air_density * drag_term * scale,
+        "crr": total_weight * GRAVITY * inv_hyp * scale,
+        "wind_speed_ms": k * np.abs(relative_speed_ms) * scale,
+        "air_density": 0.5 * cda * drag_term * scale,
+        "drivetrain_efficiency": -power / (efficiency * 100),
+    }
+    dp_dv = (f_rolling + f_grade + f_air) / efficiency + k * np.abs(relative_speed_ms) * scale
+    return dp_dv, partials
+
+# Speed at the given power and its sensitivities. Returns (speed_ms, dict of
+# dv/dθ keyed by SENSITIVITY_INPUTS plus "power").
+def speed_sensitivities(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
+    speed_ms = calculate_speed_batch(power, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                                     drivetrain_efficiency)
+    dp_dv, partials = power_partials(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                                     drivetrain_efficiency)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sensitivities = {name: -partial / dp_dv for name, partial in partials.items()}
+        sensitivities["power"] = 1.0 / dp_dv
+    return speed_ms, sensitivities
+
+# Finish time (s) over distance_m at the given power and its sensitivities.
+# Returns (time, dict of dT/dθ keyed by SENSITIVITY_INPUTS plus "power").
+def finish_time_sensitivities(distance_m, power, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                              drivetrain_efficiency):
+    speed_ms, speed_sensitivity = speed_sensitivities(power, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                                                      drivetrain_efficiency)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time_s = distance_m / speed_ms
+        return time_s, {name: -time_s / speed_ms * dv for name, dv in speed_sensitivity.items()}
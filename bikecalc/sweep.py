@@ -0,0 +1,123 @@
+"""Two-dimensional parameter sweeps of the steady-state speed.
+
+Any two inputs of calculate_speed_batch (power, mass, CdA, Crr, wind, grade,
+air density, drivetrain efficiency) are swept over a grid by broadcasting a
+row vector against a column vector. The grid is solved a block of rows at a
+time, so the temporaries of the speed solve stay small however fine the grid.
+refine_grid instead samples adaptively, densely only where the surface bends.
+"""
+import numpy as np
+
+from bikecalc.physics import calculate_speed_batch
+
+# Arguments of calculate_speed_batch that can be swept
+SWEEP_INPUTS = ("power", "total_weight", "grade", "cda", "crr", "wind_speed_ms", "air_density", "drivetrain_efficiency")
+
+# Grid points solved per call; a few MB of temporaries that stay in cache
+CHUNK_ELEMENTS = 1 << 17
+
+# Speed (m/s) over the grid x_values × y_values of the inputs x_name and
+# y_name, with every other input at the value given in `inputs` (a dict keyed
+# by SWEEP_INPUTS). Returns an array of shape (len(y_values), len(x_values)),
+# rows along y as a heatmap draws them.
+def sweep_speed(x_name, x_values, y_name, y_values, inputs, chunk_elements=CHUNK_ELEMENTS):
+    _check_axes(x_name, y_name)
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+
+    speed_ms = np.empty((len(y_values), len(x_values)))
+    rows = max(1, chunk_elements // max(1, len(x_values)))
+    args = dict(inputs)
+    args[x_name] = x_values[None, :]
+    for start in range(0, len(y_values), rows):
+        block = slice(start, start + rows)
+        args[y_name] = y_values[block, None]
+        speed_ms[block] = calculate_speed_batch(**{name: args[name] for name in SWEEP_INPUTS})
+    return speed_ms
+
+# Speed (m/s) at the points (x[i], y[i]) of the inputs x_name and y_name, for
+# scattered samples such as those of refine_grid
+def speed_at_points(x_name, x, y_name, y, inputs):
+    _check_axes(x_name, y_name)
+    args = {**inputs, x_name: x, y_name: y}
+    return calculate_speed_batch(**{name: args[name] for name in SWEEP_INPUTS})
+
+def _check_axes(x_name, y_name):
+    if x_name == y_name:
+        raise ValueError("Sweep two different inputs")
+    for name in (x_name, y_name):
+        if name not in SWEEP_INPUTS:
+            raise ValueError(f"Cannot sweep {name}; choose one of {', '.join(SWEEP_INPUTS)}")
+
+# Adaptive alternative to a uniform grid: func(x, y) -> z, vectorized over
+# point arrays, is sampled on a coarse grid of base_cells × base_cells cells,
+# and every cell whose center or edge midpoints differ from the bilinear
+# interpolation of its corners by more than tol is split into four, down to
+# max_depth levels. All cells of a level are probed with one call of func, so
+# smooth regions cost a handful of solves and the work goes where the surface
+# bends. Returns (x, y, z, sampled): the finest lattice of
+# base_cells * 2**max_depth + 1 points per axis, z of shape (len(y), len(x))
+# filled by bilinear interpolation inside every unsplit cell, and a boolean
+# mask of the lattice points where func was evaluated.
+def refine_grid(func, x_range, y_range, tol, base_cells=8, max_depth=5):
+    step = 1 << max_depth
+    n = base_cells * step + 1
+    x = np.linspace(*x_range, n)
+    y = np.linspace(*y_range, n)
+    values = np.full((n, n), np.nan)
+    sampled = np.zeros((n, n), dtype=bool)
+
+    def sample(rows, cols):
+        flat = np.unique(np.concatenate(rows) * n + np.concatenate(cols))
+        flat = flat[~sampled.flat[flat]]
+        if len(flat):
+            row, col = np.divmod(flat, n)
+            values.flat[flat] = func(x[col], y[row])
+            sampled.flat[flat] = True
+
+    coarse = np.arange(0, n, step)
+    row0, col0 = (index.ravel() for index in np.meshgrid(coarse[:-1], coarse[:-1], indexing="ij"))
+    sample([row0, row0, row0 + step, row0 + step], [col0, col0 + step, col0, col0 + step])
+
+    z = np.empty((n, n))
+    size = step
+    while len(row0):
+        corners = (values[row0, col0], values[row0, col0 + size], values[row0 + size, col0],
+                   values[row0 + size, col0 + size])
+        split = np.zeros(len(row0), dtype=bool)
+        if size > 1:
+            half = size // 2
+            # Center and edge midpoints, which are also the corners of the children
+            probes = [(row0 + half, col0 + half, (0, 1, 2, 3)), (row0, col0 + half, (0, 1)),
+                      (row0 + size, col0 + half, (2, 3)), (row0 + half, col0, (0, 2)),
+                      (row0 + half, col0 + size, (1, 3))]
+            sample([rows for rows, _, _ in probes], [cols for _, cols, _ in probes])
+            for rows, cols, around in probes:
+                with np.errstate(invalid="ignore"):
+                    error = np.abs(values[rows, cols] - sum(corners[i] for i in around) / len(around))
+                    split |= error > tol
+
+        leaf = ~split
+        _fill_bilinear(z, row0[leaf], col0[leaf], size, [corner[leaf] for corner in corners])
+        if size == 1:
+            break
+        row0, col0 = row0[split], col0[split]
+        row0, col0 = (np.concatenate((row0, row0, row0 + half, row0 + half)),
+                      np.concatenate((col0, col0 + half, col0, col0 + half)))
+        size = half
+
+    z[sampled] = values[sampled]
+    return x, y, z, sampled
+
+# Fill the (size + 1)² lattice points of square cells from their corner values
+# (lower-left, lower-right, upper-left, upper-right)
+def _fill_bilinear(z, row0, col0, size, corners):
+    if not len(row0):
+        return
+    offset = np.arange(size + 1)
+    t = offset / size
+    ty, tx = t[None, :, None], t[None, None, :]
+    v00, v01, v10, v11 = (corner[:, None, None] for corner in corners)
+    with np.errstate(invalid="ignore"):
+        z[row0[:, None, None] + offset[None, :, None], col0[:, None, None] + offset[None, None, :]] = (
+            (v00 * (1 - tx) + v01 * tx) * (1 - ty) + (v10 * (1 - tx) + v11 * tx) * ty)
@@ -1,9 +1,33 @@
+import functools
+import io
+import os
+import time
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import math
 import plotly.graph_objects as go
-from datetime import timedelta
+
+from bikecalc.batch import EVENT_POWER_PERCENT
+from bikecalc.course import course_splits, elevation_gain, read_course, segment_course, simulate_course, track_distance
+from bikecalc.kinetics import simulate_kinetic
+from bikecalc.metrics import calculate_normalized_power, estimate_ftp, mean_max_power, resample_power
+from bikecalc.montecarlo import bin_course, sample_finish_times
+from bikecalc.pacing import optimal_pacing
+from bikecalc.powerduration import course_race_power, fit_critical_power, race_power
+from bikecalc.ridefile import read_ride
+from bikecalc.sensitivity import finish_time_sensitivities, power_partials
+from bikecalc.sweep import refine_grid, speed_at_points, sweep_speed
+from bikecalc.wbal import exhausted_intervals, w_prime_balance
+from bikecalc.physics import (
+    calculate_air_density,
+    calculate_intensity_factor,
+    calculate_power,
+    calculate_power_batch,
+    calculate_speed,
+    calculate_tss,
+    format_time,
+)
 
 # Set page configuration
 st.set_page_config(
@@ -108,14 +132,553 @@ footer {
 # Header
 st.markdown("<div class='custom-header'>BIKE POWER SPEED CALCULATOR</div>", unsafe_allow_html=True)
 
-# Create tabs for different calculator modes
-tab1, tab2, tab3 = st.tabs(["Power-Speed Calculator", "Training Metrics", "Race Predictor"])
+# Performance panel, shown in the sidebar with ?perf=1 in the URL or
+# BIKECALC_PERF=1 in the environment. Stage times are the latest run of each
+# stage, including fragment reruns of a single tab; call counts, cache hits
+# and call times add up over the session.
+PERF_ENABLED = os.environ.get("BIKECALC_PERF") == "1" or st.query_params.get("perf") == "1"
 
-# Constants
-AIR_DENSITY_SEA_LEVEL = 1.225  # kg/m³
-GRAVITY = 9.8067  # m/s²
+def perf_stats():
+    return st.session_state.setdefault("perf_stats", {"stages": {}, "functions": {}})
 
-with tab1:
+def record_stage(name, seconds):
+    if PERF_ENABLED:
+        perf_stats()["stages"][name] = seconds
+
+# Times consecutive stages of a tab body: each lap() records the time since
+# the previous one
+class StageTimer:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.last = time.perf_counter()
+    
+    def lap(self, stage):
+        now = time.perf_counter()
+        record_stage(f"{self.prefix}: {stage}", now - self.last)
+        self.last = now
+
+# Decorator: record the total time of every call as a stage
+def timed_stage(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Cached computations. Every widget change reruns the tab, so the expensive
+# work (file parsing, course-wide solves, pacing, Monte Carlo, sweeps) is
+# memoized on its inputs. A cache hit unpickles a copy of the result, which
+# costs more than a single speed solve or building a small go.Figure, so those
+# run uncached and figures are built from cached NumPy data. max_entries
+# bounds each cache; the least recently used entries are evicted first.
+CACHE_MAX_ENTRIES = 128
+
+# st.cache_data with call counting for the performance panel: the inner
+# function only runs on a cache miss
+def cached(func):
+    @functools.wraps(func)
+    def compute(*args, **kwargs):
+        if PERF_ENABLED:
+            perf_stats()["functions"][func.__name__]["misses"] += 1
+        return func(*args, **kwargs)
+    
+    cached_compute = st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)(compute)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PERF_ENABLED:
+            return cached_compute(*args, **kwargs)
+        stats = perf_stats()["functions"].setdefault(func.__name__, {"calls": 0, "misses": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        start = time.perf_counter()
+        try:
+            return cached_compute(*args, **kwargs)
+        finally:
+            stats["seconds"] += time.perf_counter() - start
+    
+    wrapper.clear = cached_compute.clear
+    return wrapper
+
+def speed_power_figure(total_weight, avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+                       target_speed, required_power, ftp):
+    # Basic speed chart
+    speeds = np.linspace(10, 45, 36)  # speeds from 10 to 45 km/h
+    speeds_ms = speeds / 3.6  # convert to m/s
+    
+    powers, _, _, _ = calculate_power_batch(speeds_ms, total_weight, avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
+    
+    # Create speed-power curve
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=speeds,
+        y=powers,
+        mode='lines',
+        name='Power Required',
+        line=dict(color='#E6754E', width=2)
+    ))
+    
+    # Add marker for current calculation
+    fig.add_trace(go.Scatter(
+        x=[target_speed],
+        y=[required_power],
+        mode='markers',
+        name='Current Point',
+        marker=dict(color='#2C3E50', size=10)
+    ))
+    
+    # Add FTP line
+    fig.add_shape(
+        type="line",
+        x0=min(speeds),
+        y0=ftp,
+        x1=max(speeds),
+        y1=ftp,
+        line=dict(
+            color="Red",
+            width=2,
+            dash="dash",
+        )
+    )
+    
+    fig.add_annotation(
+        x=min(speeds),
+        y=ftp,
+        text="FTP",
+        showarrow=False,
+        yshift=10,
+        font=dict(color="Red")
+    )
+    
+    fig.update_layout(
+        title="Speed vs Power",
+        xaxis_title="Speed (km/h)",
+        yaxis_title="Power (Watts)",
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01
+        ),
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+# Marginal gains of the calculator tab: label, input and step of each change
+MARGINAL_GAINS = [
+    ("−1 kg", "total_weight", -1.0),
+    ("−0.01 CdA", "cda", -0.01),
+    ("−0.001 Crr", "crr", -0.001),
+    ("+1% drivetrain efficiency", "drivetrain_efficiency", 1.0),
+    ("−1 km/h headwind", "wind_speed_ms", -1 / 3.6),
+    ("−0.01 kg/m³ air density", "air_density", -0.01),
+    ("−0.1% grade", "grade", -0.1),
+    ("+10 W", "power", 10.0),
+]
+
+def marginal_gains_figure(by_power, distance_m, power, speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density,
+                          drivetrain_efficiency):
+    # First-order effect of every gain from the analytic derivatives: time
+    # saved at the target power, or else power saved at the target speed
+    inputs = (total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
+    if by_power:
+        _, sensitivities = finish_time_sensitivities(distance_m, power, *inputs)
+        gains = [(label, -float(sensitivities[name]) * step) for label, name, step in MARGINAL_GAINS]
+        unit, axis_title = "s", "Time saved (seconds)"
+    else:
+        _, partials = power_partials(speed_ms, *inputs)
+        gains = [(label, -float(partials[name]) * step) for label, name, step in MARGINAL_GAINS if name in partials]
+        unit, axis_title = "W", "Power saved (watts)"
+    gains.sort(key=lambda gain: abs(gain[1]))
+    labels = [label for label, _ in gains]
+    values = np.array([value for _, value in gains])
+    
+    # Tornado: the gain to the right, the same change the other way to the left
+    fig = go.Figure()
+    
+    fig.add_trace(go.Bar(
+        x=values,
+        y=labels,
+        orientation='h',
+        name='Gain',
+        marker=dict(color='#E6754E'),
+        hovertemplate=f"%{{y}}: %{{x:.1f}} {unit}<extra></extra>",
+    ))
+    
+    fig.add_trace(go.Bar(
+        x=-values,
+        y=labels,
+        orientation='h',
+        name='Opposite change',
+        marker=dict(color='#2C3E50', opacity=0.4),
+        hoverinfo='skip',
+    ))
+    
+    fig.update_layout(
+        title="Marginal Gains",
+        xaxis_title=axis_title,
+        barmode='overlay',
+        legend=dict(
+            yanchor="bottom",
+            y=0.01,
+            xanchor="left",
+            x=0.01
+        ),
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+# Parameter sweep axes of the calculator tab: label -> (input, factor from the
+# shown unit to the solver's unit, slider min, slider max, step)
+SWEEP_AXES = {
+    "Power (W)": ("power", 1.0, 50.0, 600.0, 10.0),
+    "System weight (kg)": ("total_weight", 1.0, 40.0, 150.0, 1.0),
+    "CdA (m²)": ("cda", 1.0, 0.15, 0.8, 0.005),
+    "Crr": ("crr", 1.0, 0.001, 0.012, 0.0001),
+    "Wind (km/h)": ("wind_speed_ms", 1 / 3.6, -50.0, 50.0, 1.0),
+    "Grade (%)": ("grade", 1.0, -15.0, 20.0, 0.5),
+    "Air density (kg/m³)": ("air_density", 1.0, 0.9, 1.4, 0.01),
+    "Drivetrain efficiency (%)": ("drivetrain_efficiency", 1.0, 90.0, 100.0, 0.5),
+}
+SWEEP_BASE_CELLS = 8  # coarse cells per axis of an adaptive sweep
+SWEEP_DISPLAY_POINTS = 300  # heatmap cells per axis sent to the browser
+
+@cached
+def sweep_grid(x_label, x_range, y_label, y_range, resolution, show_time, distance_m, inputs, tolerance=None):
+    x_name, x_factor = SWEEP_AXES[x_label][:2]
+    y_name, y_factor = SWEEP_AXES[y_label][:2]
+    
+    def to_output(speed_ms):
+        if show_time:
+            with np.errstate(divide="ignore"):
+                return distance_m / speed_ms / 60
+        return speed_ms * 3.6
+    
+    if tolerance is None:
+        # The whole grid in one broadcast solve (in blocks of rows, see sweep_speed)
+        x_values = np.linspace(*x_range, resolution)
+        y_values = np.linspace(*y_range, resolution)
+        z = to_output(sweep_speed(x_name, x_values * x_factor, y_name, y_values * y_factor, inputs))
+        solves = z.size
+    else:
+        # Solve only where the surface bends; the finest lattice has at least
+        # `resolution` points per axis
+        max_depth = max(1, int(np.ceil(np.log2((resolution - 1) / SWEEP_BASE_CELLS))))
+        x_values, y_values, z, sampled = refine_grid(
+            lambda x, y: to_output(speed_at_points(x_name, x * x_factor, y_name, y * y_factor, inputs)),
+            x_range, y_range, tolerance, SWEEP_BASE_CELLS, max_depth)
+        solves = int(sampled.sum())
+    
+    # Plotly sends the heatmap as a JSON list, about 10 MB and 0.6 s for
+    # 1000 × 1000 cells, so the solved grid is thinned to screen resolution
+    # and rounded to the hover precision
+    rows = np.linspace(0, len(y_values) - 1, min(len(y_values), SWEEP_DISPLAY_POINTS)).round().astype(int)
+    cols = np.linspace(0, len(x_values) - 1, min(len(x_values), SWEEP_DISPLAY_POINTS)).round().astype(int)
+    return x_values[cols], y_values[rows], np.round(z[np.ix_(rows, cols)], 2), solves
+
+def sweep_figure(x_label, y_label, x_values, y_values, z, show_time, inputs):
+    x_name, x_factor = SWEEP_AXES[x_label][:2]
+    y_name, y_factor = SWEEP_AXES[y_label][:2]
+    
+    if show_time:
+        colorbar_title, hover_value = "Time (min)", "%{z:.1f} min"
+    else:
+        colorbar_title, hover_value = "Speed (km/h)", "%{z:.1f} km/h"
+    
+    fig = go.Figure(go.Heatmap(
+        x=x_values,
+        y=y_values,
+        z=z,
+        colorscale="RdYlGn_r" if show_time else "RdYlGn",
+        colorbar=dict(title=colorbar_title),
+        hovertemplate=f"{x_label}: %{{x}}<br>{y_label}: %{{y}}<br>{hover_value}<extra></extra>",
+    ))
+    
+    # Current setup
+    fig.add_trace(go.Scatter(
+        x=[inputs[x_name] / x_factor],
+        y=[inputs[y_name] / y_factor],
+        mode='markers',
+        name='Current setup',
+        marker=dict(color='#2C3E50', size=10, symbol='x'),
+    ))
+    
+    fig.update_layout(
+        title=f"{'Finish Time' if show_time else 'Speed'} by {x_label.split(' (')[0]} and {y_label.split(' (')[0]}",
+        xaxis_title=x_label,
+        yaxis_title=y_label,
+        showlegend=False,
+        height=550,
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+def power_zones_figure(ftp_training):
+    # Define zone boundary percentages
+    zone_boundaries = np.array([0, 0.55, 0.75, 0.90, 1.05, 1.20, 1.50, 2.0])
+    zone_colors = ['#ccfdcc', '#94d494', '#4eb74e', '#ffd700', '#ffaa00', '#ff5555', '#ff0000']
+    zone_names = ['Z1', 'Z2', 'Z3', 'Z4', 'Z5', 'Z6', 'Z7']
+    
+    # One horizontal bar per zone, all in a single trace: each bar starts at
+    # the zone's lower boundary and is as long as the zone is wide
+    zone_start = zone_boundaries[:-1] * ftp_training
+    zone_end = zone_boundaries[1:] * ftp_training
+    
+    fig = go.Figure(go.Bar(
+        x=zone_end - zone_start,
+        base=zone_start,
+        y=[0] * len(zone_names),
+        orientation='h',
+        width=1,
+        marker=dict(color=zone_colors, opacity=0.5, line=dict(color="gray", width=1)),
+        text=zone_names,
+        textposition='inside',
+        insidetextanchor='middle',
+        textfont=dict(size=12, color="black"),
+        customdata=np.column_stack((zone_start, zone_end)),
+        hovertemplate="%{text}: %{customdata[0]:.0f}-%{customdata[1]:.0f} W<extra></extra>",
+    ))
+    
+    fig.update_layout(
+        title="Power Zones Based on Your FTP",
+        xaxis_title="Power (Watts)",
+        yaxis=dict(
+            showticklabels=False,
+            showgrid=False,
+            zeroline=False,
+        ),
+        height=200,
+        margin=dict(l=20, r=20, t=40, b=20),
+        showlegend=False
+    )
+    
+    return fig
+
+@cached
+def load_course(data, segment_length=100.0):
+    lat, lon, elevation = read_course(data)
+    if len(lat) < 2:
+        raise ValueError("The course file has fewer than two track points")
+    course = segment_course(track_distance(lat, lon), elevation, segment_length)
+    if not len(course[0]):
+        raise ValueError("The course has no distance; all track points are at the same position")
+    return course
+
+# 1 Hz power of a recorded ride (FIT/TCX/GPX bytes), pauses removed
+@cached
+def load_ride_power(data):
+    ride = read_ride(io.BytesIO(data), fields=("time", "power"))
+    if not np.isfinite(ride["power"]).any():
+        raise ValueError("The ride file has no power data")
+    return resample_power(ride["time"], ride["power"])
+
+@cached
+def ride_power_curve(ride_power):
+    return mean_max_power(ride_power, refine=True)
+
+def power_curve_figure(durations, best_power):
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=durations,
+        y=best_power,
+        mode='lines',
+        name='Best power',
+        line=dict(color='#E6754E', width=3)
+    ))
+    
+    fig.update_layout(
+        title="Mean-Maximal Power",
+        xaxis=dict(title="Duration", type="log",
+                   tickvals=[1, 5, 15, 60, 300, 1200, 3600, 3 * 3600, 6 * 3600],
+                   ticktext=["1s", "5s", "15s", "1min", "5min", "20min", "1h", "3h", "6h"]),
+        yaxis_title="Power (watts)",
+        showlegend=False,
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+# Inputs that can be filled in from an uploaded ride (FTP in all tabs, CP and
+# W' in the race predictor) are keyed, and their default values live in
+# session state
+FTP_KEYS = ("ftp", "ftp_training", "ftp_race")
+SHARED_INPUT_DEFAULTS = {**dict.fromkeys(FTP_KEYS, 250), "race_cp": 240, "race_w_prime": 20.0}
+for key, value in SHARED_INPUT_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
+
+# Button callback: copy an FTP value into the FTP input of every tab
+def set_ftp(value):
+    for key in FTP_KEYS:
+        st.session_state[key] = value
+
+# Button callback: copy a critical power fit into the race predictor
+def set_critical_power(cp, w_prime_kj):
+    st.session_state["race_cp"] = cp
+    st.session_state["race_w_prime"] = w_prime_kj
+
+@cached
+def solve_race_power(distance_m, cp, w_prime, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
+    return race_power(distance_m, cp, w_prime, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
+
+@cached
+def solve_course_race_power(segment_length, grade, altitude, cp, w_prime, total_weight, cda, crr, wind_speed_ms, temperature,
+                            drivetrain_efficiency):
+    power, _, _ = course_race_power(segment_length, grade, altitude, cp, w_prime, total_weight, cda, crr, wind_speed_ms,
+                                    temperature, drivetrain_efficiency)
+    return power
+
+@cached
+def kinetic_finish_time(segment_end, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                        drivetrain_efficiency, dt):
+    times, _, _ = simulate_kinetic(segment_end, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                                   drivetrain_efficiency, dt=dt)
+    return times[-1]
+
+@cached
+def pacing_plan(segment_length, grade, altitude, target_np, total_weight, cda, crr, wind_speed_ms, temperature,
+                drivetrain_efficiency, max_power):
+    return optimal_pacing(segment_length, grade, altitude, target_np, total_weight, cda, crr, wind_speed_ms, temperature,
+                          drivetrain_efficiency, max_power=max_power)
+
+def pacing_figure(segment_end, power, sustainable_power, w_balance):
+    # Step plot: every segment is ridden at constant power
+    distance_km = np.concatenate(([0.0], segment_end)) / 1000
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=distance_km,
+        y=np.append(power, power[-1]),
+        mode='lines',
+        name='Optimal power (watts)',
+        line=dict(color='#E6754E', width=2, shape='hv')
+    ))
+    
+    # W' balance at the end of every segment
+    fig.add_trace(go.Scatter(
+        x=segment_end / 1000,
+        y=w_balance / 1000,
+        mode='lines',
+        name="W′ balance (kJ)",
+        yaxis='y2',
+        line=dict(color='#2C3E50', width=1)
+    ))
+    
+    fig.add_hline(y=sustainable_power, line_dash="dash", line_color="#2C3E50",
+                  annotation_text="Even power", annotation_position="top left")
+    
+    fig.update_layout(
+        title="Optimal Pacing Plan",
+        xaxis_title="Distance (km)",
+        yaxis_title="Power (watts)",
+        yaxis2=dict(title="W′ balance (kJ)", overlaying="y", side="right", showgrid=False),
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01
+        ),
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+@cached
+def finish_time_distribution(segment_length, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                             drivetrain_efficiency, power_sd, cda_sd, crr_sd, wind_sd_ms, temperature_sd, draws, seed):
+    # Only the percentiles and the histogram are kept, not every draw
+    segment_length, grade, altitude = bin_course(segment_length, grade, altitude)
+    times = sample_finish_times(segment_length, grade, altitude, power, total_weight, cda, crr, wind_speed_ms, temperature,
+                                drivetrain_efficiency, power_sd, cda_sd, crr_sd, wind_sd_ms, temperature_sd, draws, seed)
+    times = times[np.isfinite(times)]
+    counts, edges = np.histogram(times, bins=60)
+    return np.percentile(times, [5, 50, 95]), counts, edges
+    
+def finish_time_figure(counts, edges, percentiles):
+    # One bar per histogram bin, in minutes
+    edges_min = edges / 60
+    
+    fig = go.Figure(go.Bar(
+        x=(edges_min[:-1] + edges_min[1:]) / 2,
+        y=counts / counts.sum() * 100,
+        width=np.diff(edges_min),
+        marker=dict(color='#E6754E', opacity=0.8),
+        hovertemplate="%{x:.1f} min: %{y:.1f}% of rides<extra></extra>",
+    ))
+    
+    for label, value in zip(("P5", "P50", "P95"), percentiles):
+        fig.add_vline(x=value / 60, line_dash="dash", line_color="#2C3E50",
+                      annotation_text=label, annotation_position="top")
+    
+    fig.update_layout(
+        title="Finish Time Distribution",
+        xaxis_title="Finish time (minutes)",
+        yaxis_title="Share of rides (%)",
+        bargap=0,
+        showlegend=False,
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+def course_profile_figure(segment_end, grade, altitude, speed_ms):
+    # Elevation at the segment edges from each segment's mean altitude and grade
+    segment_length = np.diff(segment_end, prepend=0.0)
+    distance_km = np.concatenate(([0.0], segment_end)) / 1000
+    elevation = np.concatenate(([altitude[0] - grade[0] * segment_length[0] / 200], altitude + grade * segment_length / 200))
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=distance_km,
+        y=elevation,
+        mode='lines',
+        name='Elevation (m)',
+        fill='tozeroy',
+        line=dict(color='#2C3E50', width=1)
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=segment_end / 1000,
+        y=speed_ms * 3.6,
+        mode='lines',
+        name='Speed (km/h)',
+        yaxis='y2',
+        line=dict(color='#E6754E', width=2)
+    ))
+    
+    fig.update_layout(
+        title="Course Profile",
+        xaxis_title="Distance (km)",
+        yaxis=dict(title="Elevation (m)", rangemode="tozero"),
+        yaxis2=dict(title="Speed (km/h)", overlaying="y", side="right", showgrid=False),
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01
+        ),
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+# Each tab body runs as a fragment: changing a widget reruns only the tab it
+# belongs to, so the other tabs keep their output instead of recomputing it.
+@st.fragment
+@timed_stage("Calculator tab")
+def power_speed_calculator_tab():
+    timer = StageTimer("Calculator")
+    
     # Create three columns for input form
     col1, col2, col3 = st.columns(3)
     
@@ -146,7 +709,7 @@ with tab1:
         drivetrain_efficiency = st.number_input("Drive train efficiency (%)", min_value=90.0, max_value=100.0, value=97.5, step=0.5, help="Typically 95-98% for clean chains")
         
         # Known FTP/CP
-        ftp = st.number_input("Known FTP/CP", min_value=100, max_value=500, value=250, help="Functional Threshold Power in watts")
+        ftp = st.number_input("Known FTP/CP", min_value=100, max_value=500, help="Functional Threshold Power in watts", key="ftp")
         
         # Calculate total system weight
         total_weight = rider_weight + clothes_gear_weight + bike_weight
@@ -190,8 +753,7 @@ with tab1:
         altitude = st.number_input("Altitude", min_value=0, max_value=3000, value=100, help="Altitude in meters")
         
         # Calculate air density based on temperature and altitude
-        # Simple model: air_density = AIR_DENSITY_SEA_LEVEL * exp(-altitude/8000) * (273/(273+temperature))
-        air_density = AIR_DENSITY_SEA_LEVEL * math.exp(-altitude/8000) * (273/(273+temperature))
+        air_density = calculate_air_density(temperature, altitude)
         st.markdown(f"**Air Density:** {air_density:.4f} kg/m³")
         
     with col3:
@@ -276,6 +838,8 @@ with tab1:
             target_speed = 0  # Will be calculated
             total_seconds = 0  # Will be calculated
     
+    timer.lap("inputs")
+    
     # Calculations section
     st.markdown("---")
     st.markdown("## Results")
@@ -286,50 +850,6 @@ with tab1:
     # Convert target speed to m/s for calculation
     target_speed_ms = target_speed / 3.6
     
-    # Calculate power required or speed achievable
-    def calculate_power(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
-        # Speed relative to air (accounting for wind)
-        relative_speed_ms = speed_ms + wind_speed_ms
-        
-        # Rolling resistance force
-        f_rolling = total_weight * GRAVITY * crr * math.cos(math.atan(grade/100))
-        
-        # Grade resistance force
-        f_grade = total_weight * GRAVITY * math.sin(math.atan(grade/100))
-        
-        # Air resistance force
-        f_air = 0.5 * cda * air_density * relative_speed_ms**2
-        
-        # Total resistance force
-        f_total = f_rolling + f_grade + f_air
-        
-        # Power required
-        power = f_total * speed_ms / (drivetrain_efficiency / 100)
-        
-        return power, f_rolling, f_grade, f_air
-    
-    def calculate_speed(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
-        # Adjust power for drivetrain efficiency
-        power_at_wheel = power * (drivetrain_efficiency / 100)
-        
-        # Function to find speed given power
-        def power_diff(speed_ms):
-            # Calculate power required at given speed
-            required_power, _, _, _ = calculate_power(speed_ms, total_weight, grade, cda, crr, wind_speed_ms, air_density, 100)  # Efficiency already applied
-            return required_power - power_at_wheel
-        
-        # Binary search to find speed
-        speed_min, speed_max = 0.1, 30.0  # m/s
-        
-        for _ in range(50):  # 50 iterations should be enough for good precision
-            speed_mid = (speed_min + speed_max) / 2
-            if power_diff(speed_mid) > 0:
-                speed_max = speed_mid
-            else:
-                speed_min = speed_mid
-                
-        return (speed_min + speed_max) / 2
-    
     # Calculate values based on target type
     if target_type == "Power":
         # Calculate speed based on given power
@@ -342,10 +862,12 @@ with tab1:
         # Calculate power required for given speed
         required_power, f_rolling, f_grade, f_air = calculate_power(target_speed_ms, total_weight, avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
     
+    timer.lap("physics solve")
+    
     # Calculate derived metrics
-    intensity_factor = required_power / ftp if ftp > 0 else 0
+    intensity_factor = calculate_intensity_factor(required_power, ftp)
     normalized_power = required_power  # Simplified for steady state
-    training_stress_score = (total_seconds / 3600) * (normalized_power / ftp) ** 2 * 100 if ftp > 0 else 0
+    training_stress_score = calculate_tss(total_seconds, normalized_power, ftp)
     
     # Determine workout difficulty
     if intensity_factor < 0.55:
@@ -362,7 +884,9 @@ with tab1:
         workout_difficulty = "Anaerobic"
     
     # Format finish time
-    finish_time = str(timedelta(seconds=int(total_seconds)))
+    finish_time = format_time(total_seconds)
+    
+    timer.lap("derived metrics")
     
     # Results section with three columns
     col1, col2, col3 = st.columns(3)
@@ -435,74 +959,62 @@ with tab1:
     # Add visualization section
     st.markdown("---")
     
-    # Basic speed chart
-    speeds = np.linspace(10, 45, 36)  # speeds from 10 to 45 km/h
-    speeds_ms = speeds / 3.6  # convert to m/s
-    
-    powers = []
-    for speed_ms in speeds_ms:
-        power, _, _, _ = calculate_power(speed_ms, total_weight, avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
-        powers.append(power)
-    
-    # Create speed-power curve
-    fig = go.Figure()
-    
-    fig.add_trace(go.Scatter(
-        x=speeds,
-        y=powers,
-        mode='lines',
-        name='Power Required',
-        line=dict(color='#E6754E', width=2)
-    ))
-    
-    # Add marker for current calculation
-    fig.add_trace(go.Scatter(
-        x=[target_speed],
-        y=[required_power],
-        mode='markers',
-        name='Current Point',
-        marker=dict(color='#2C3E50', size=10)
-    ))
-    
-    # Add FTP line
-    fig.add_shape(
-        type="line",
-        x0=min(speeds),
-        y0=ftp,
-        x1=max(speeds),
-        y1=ftp,
-        line=dict(
-            color="Red",
-            width=2,
-            dash="dash",
-        )
-    )
-    
-    fig.add_annotation(
-        x=min(speeds),
-        y=ftp,
-        text="FTP",
-        showarrow=False,
-        yshift=10,
-        font=dict(color="Red")
-    )
+    timer.lap("results")
     
-    fig.update_layout(
-        title="Speed vs Power",
-        xaxis_title="Speed (km/h)",
-        yaxis_title="Power (Watts)",
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="left",
-            x=0.01
-        ),
-        margin=dict(l=20, r=20, t=40, b=20),
-    )
+    fig = speed_power_figure(total_weight, avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency,
+                             target_speed, required_power, ftp)
+    timer.lap("speed-power figure")
+    st.plotly_chart(fig, use_container_width=True)
+    timer.lap("chart render")
     
+    fig = marginal_gains_figure(target_type == "Power", distance * 1000, required_power, target_speed_ms, total_weight,
+                                avg_grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency)
+    timer.lap("marginal gains figure")
     st.plotly_chart(fig, use_container_width=True)
+    timer.lap("marginal gains render")
+    
+    # Finish time or speed over a grid of any two inputs, e.g. CdA × Crr
+    st.markdown("### Parameter Sweep")
+    if st.checkbox("Compare setups over two inputs", key="sweep",
+                   help="Solve the ride at the target power over a grid of two inputs, the others as set above"):
+        sweep_labels = list(SWEEP_AXES)
+        sweep_col1, sweep_col2, sweep_col3 = st.columns(3)
+        with sweep_col1:
+            x_label = st.selectbox("Horizontal axis", sweep_labels, index=2, key="sweep_x")
+            x_range = st.slider("Range", *SWEEP_AXES[x_label][2:4], value=SWEEP_AXES[x_label][2:4], step=SWEEP_AXES[x_label][4],
+                                key=f"sweep_x_range_{x_label}")
+        with sweep_col2:
+            y_label = st.selectbox("Vertical axis", [label for label in sweep_labels if label != x_label], index=2, key="sweep_y")
+            y_range = st.slider("Range", *SWEEP_AXES[y_label][2:4], value=SWEEP_AXES[y_label][2:4], step=SWEEP_AXES[y_label][4],
+                                key=f"sweep_y_range_{y_label}")
+        with sweep_col3:
+            sweep_output = st.radio("Show", ["Finish time", "Speed"], key="sweep_output", horizontal=True)
+            resolution = st.select_slider("Grid points per axis", options=[50, 100, 200, 500, 1000], value=200,
+                                          key="sweep_resolution")
+            adaptive = st.checkbox("Adaptive grid", key="sweep_adaptive",
+                                   help="Start coarse and only refine cells where the interpolation error is above the tolerance")
+            tolerance = None
+            if adaptive:
+                tolerance = st.number_input(f"Tolerance ({'min' if sweep_output == 'Finish time' else 'km/h'})",
+                                            min_value=0.01, max_value=5.0, value=0.1, step=0.05, key="sweep_tolerance")
+        
+        sweep_inputs = dict(power=float(required_power), total_weight=total_weight, grade=avg_grade, cda=cda, crr=crr,
+                            wind_speed_ms=wind_speed_ms, air_density=float(air_density),
+                            drivetrain_efficiency=drivetrain_efficiency)
+        show_time = sweep_output == "Finish time"
+        x_values, y_values, z, solves = sweep_grid(x_label, x_range, y_label, y_range, resolution, show_time, distance * 1000,
+                                                   sweep_inputs, tolerance)
+        fig = sweep_figure(x_label, y_label, x_values, y_values, z, show_time, sweep_inputs)
+        if adaptive:
+            st.caption(f"{solves:,} solves instead of {resolution**2:,} for a uniform grid")
+        timer.lap("sweep figure")
+        st.plotly_chart(fig, use_container_width=True)
+        timer.lap("sweep render")
 
-with tab2:
+@st.fragment
+@timed_stage("Training tab")
+def training_metrics_tab():
+    timer = StageTimer("Training")
     st.markdown("### Training Metrics Calculator")
     
     col1, col2 = st.columns(2)
@@ -510,18 +1022,34 @@ with tab2:
     with col1:
         st.markdown("#### Input")
         
-        ftp_training = st.number_input("Your FTP (watts)", min_value=100, max_value=500, value=250, help="Functional Threshold Power", key="ftp_training")
+        ftp_training = st.number_input("Your FTP (watts)", min_value=100, max_value=500, help="Functional Threshold Power", key="ftp_training")
         
         workout_type = st.radio("Workout type", ["Actual (with data)", "Planned"])
+        ride_power = None
         
         if workout_type == "Actual (with data)":
-            avg_power = st.number_input("Average Power (watts)", min_value=50, max_value=500, value=200)
-            normalized_power = st.number_input("Normalized Power (watts)", min_value=50, max_value=500, value=210)
-            duration_hours = st.number_input("Duration (hours)", min_value=0.0, max_value=24.0, value=1.5, step=0.25)
+            # A recorded ride gives the power metrics directly; otherwise they are typed in
+            ride_file = st.file_uploader("Ride file (FIT/TCX/GPX)", type=["fit", "tcx", "gpx"], key="training_ride",
+                                         help="Compute average power, normalized power and duration from the recording")
+            if ride_file is not None:
+                try:
+                    ride_power = load_ride_power(ride_file.getvalue())
+                except ValueError as error:
+                    st.error(str(error))
+            
+            if ride_power is None:
+                avg_power = st.number_input("Average Power (watts)", min_value=50, max_value=500, value=200)
+                normalized_power = st.number_input("Normalized Power (watts)", min_value=50, max_value=500, value=210)
+                duration_hours = st.number_input("Duration (hours)", min_value=0.0, max_value=24.0, value=1.5, step=0.25)
+            else:
+                avg_power = float(ride_power.mean())
+                normalized_power = calculate_normalized_power(ride_power)
+                duration_hours = len(ride_power) / 3600
+                st.markdown(f"**Riding time:** {format_time(len(ride_power))} (pauses removed)")
             
             # Calculate metrics
-            intensity = normalized_power / ftp_training if ftp_training > 0 else 0
-            tss = (duration_hours * 3600) * normalized_power * intensity / (ftp_training * 3600) * 100 if ftp_training > 0 else 0
+            intensity = calculate_intensity_factor(normalized_power, ftp_training)
+            tss = calculate_tss(duration_hours * 3600, normalized_power, ftp_training)
             
         else:  # Planned workout
             workout_intensity = st.slider("Planned intensity (% of FTP)", min_value=40, max_value=150, value=75, step=5)
@@ -535,7 +1063,9 @@ with tab2:
             normalized_power = avg_power
             
             # Calculate TSS
-            tss = (duration_hours * 3600) * normalized_power * intensity / (ftp_training * 3600) * 100 if ftp_training > 0 else 0
+            tss = calculate_tss(duration_hours * 3600, normalized_power, ftp_training)
+    
+    timer.lap("inputs and metrics")
     
     with col2:
         st.markdown("#### Results")
@@ -604,6 +1134,45 @@ with tab2:
         </div>
         """, unsafe_allow_html=True)
     
+    timer.lap("results")
+    
+    if ride_power is not None:
+        # Best efforts of the uploaded ride
+        st.markdown("---")
+        st.markdown("### Power Duration Curve")
+        
+        durations, best_power = ride_power_curve(ride_power)
+        timer.lap("power curve")
+        fig = power_curve_figure(durations, best_power)
+        timer.lap("power curve figure")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        estimated_ftp = estimate_ftp(durations, best_power)
+        if estimated_ftp is None:
+            st.info("Upload a ride of at least 20 minutes to estimate FTP from the power curve")
+        else:
+            estimated_ftp = int(np.clip(round(estimated_ftp), 100, 500))
+            st.markdown(f"**Estimated FTP:** {estimated_ftp} W (95% of best 20 minute power)")
+            # The callback updates the FTP inputs before the whole app reruns
+            if st.button("Use as FTP in all tabs", key="apply_estimated_ftp", on_click=set_ftp, args=(estimated_ftp,)):
+                st.rerun()
+        
+        try:
+            cp, w_prime = fit_critical_power(durations, best_power)
+        except ValueError:
+            cp = None
+        if cp is not None:
+            cp = int(np.clip(round(cp), 100, 500))
+            w_prime_kj = float(np.clip(round(w_prime / 1000, 1), 5.0, 50.0))
+            st.markdown(f"**Critical power:** {cp} W, **W′:** {w_prime_kj:.1f} kJ (fitted to 2-20 minute efforts)")
+            ride_balance = w_prime_balance(ride_power, cp, w_prime_kj * 1000)
+            lowest = int(np.argmin(ride_balance))
+            st.markdown(f"**Lowest W′ balance:** {ride_balance[lowest] / 1000:.1f} kJ after {format_time(lowest + 1)}")
+            if st.button("Use CP and W′ in the race predictor", key="apply_critical_power", on_click=set_critical_power,
+                         args=(cp, w_prime_kj)):
+                st.rerun()
+        timer.lap("ride analysis")
+    
     # Training zones reference
     st.markdown("---")
     st.markdown("### Training Zones Reference")
@@ -660,72 +1229,18 @@ with tab2:
         personal_zones_df = pd.DataFrame(personal_zones)
         st.table(personal_zones_df)
     
-    # Show a visualization of the training zones
-    fig = go.Figure()
-    
-    # Define zone boundary percentages
-    zone_boundaries = [0, 0.55, 0.75, 0.90, 1.05, 1.20, 1.50, 2.0]
-    zone_colors = ['#ccfdcc', '#94d494', '#4eb74e', '#ffd700', '#ffaa00', '#ff5555', '#ff0000']
-    zone_names = ['Z1', 'Z2', 'Z3', 'Z4', 'Z5', 'Z6', 'Z7']
-    
-    # Power range for x-axis
-    power_range = np.linspace(0, ftp_training * 2, 100)
-    
-    # Add vertical lines for zone boundaries
-    for i, boundary in enumerate(zone_boundaries[1:-1], 1):
-        fig.add_shape(
-            type="line",
-            x0=boundary * ftp_training,
-            y0=0,
-            x1=boundary * ftp_training,
-            y1=1,
-            line=dict(
-                color="gray",
-                width=1,
-                dash="dash",
-            )
-        )
-    
-    # Add colored rectangles for each zone
-    for i in range(len(zone_names)):
-        fig.add_shape(
-            type="rect",
-            x0=zone_boundaries[i] * ftp_training,
-            x1=zone_boundaries[i+1] * ftp_training,
-            y0=0,
-            y1=1,
-            fillcolor=zone_colors[i],
-            opacity=0.5,
-            line=dict(width=0),
-        )
-        
-        # Add zone labels
-        fig.add_annotation(
-            x=((zone_boundaries[i] + zone_boundaries[i+1]) / 2) * ftp_training,
-            y=0.5,
-            text=zone_names[i],
-            showarrow=False,
-            font=dict(size=12, color="black")
-        )
-    
-    fig.update_layout(
-        title="Power Zones Based on Your FTP",
-        xaxis_title="Power (Watts)",
-        yaxis=dict(
-            showticklabels=False,
-            showgrid=False,
-            zeroline=False,
-        ),
-        height=200,
-        margin=dict(l=20, r=20, t=40, b=20),
-        showlegend=False
-    )
+    timer.lap("zone tables")
     
+    # Show a visualization of the training zones
+    fig = power_zones_figure(ftp_training)
+    timer.lap("zones figure")
     st.plotly_chart(fig, use_container_width=True)
+    timer.lap("chart render")
 
-# Replace the Race Predictor tab section with this updated code
-
-with tab3:
+@st.fragment
+@timed_stage("Race tab")
+def race_predictor_tab():
+    timer = StageTimer("Race")
     st.markdown("### Race Predictor")
     
     # Simple layout with basic inputs
@@ -734,8 +1249,12 @@ with tab3:
     with col1:
         st.markdown("#### Rider Details")
         
-        ftp_race = st.number_input("Your FTP (watts)", min_value=100, max_value=500, value=250, key="ftp_race")
+        ftp_race = st.number_input("Your FTP (watts)", min_value=100, max_value=500, key="ftp_race")
         weight_race = st.number_input("Your weight (kg)", min_value=40.0, max_value=150.0, value=75.0, step=0.5, key="weight_race")
+        race_cp = st.number_input("Critical power (watts)", min_value=100, max_value=500, key="race_cp",
+                                  help="Power that can be sustained without exhausting W′")
+        race_w_prime = st.number_input("W′ (kJ)", min_value=5.0, max_value=50.0, step=0.5, key="race_w_prime",
+                                       help="Work capacity above critical power")
         
         # Additional inputs needed for proper calculation
         clothes_gear_weight_race = st.number_input("Clothes & gear (kg)", min_value=0.0, max_value=20.0, value=1.5, step=0.1, key="clothes_gear_race")
@@ -752,23 +1271,50 @@ with tab3:
         # Event details
         st.markdown("#### Event Details")
         
-        event_type = st.selectbox("Event type", ["Time trial", "Road race", "Criterium", "Gran fondo"])
-        event_distance = st.number_input("Distance (km)", min_value=5.0, max_value=300.0, value=40.0, step=5.0, key="race_distance")
+        event_type = st.selectbox("Event type", list(EVENT_POWER_PERCENT))
+        
+        # Race power from a fixed share of FTP per event type, or from the critical
+        # power model for the predicted duration
+        power_model = st.radio("Race power from", ["Event type", "Critical power"], key="race_power_model", horizontal=True)
+        
+        # Optional course file: the route is split into segments with their own grade and altitude
+        course_file = st.file_uploader("Course file (GPX/TCX/FIT)", type=["gpx", "tcx", "fit"], key="race_course",
+                                       help="Simulate the actual route segment by segment instead of an average grade")
+        course = None
+        if course_file is not None:
+            try:
+                course = load_course(course_file.getvalue())
+            except ValueError as error:
+                st.error(str(error))
+        
+        if course is None:
+            event_distance = st.number_input("Distance (km)", min_value=5.0, max_value=300.0, value=40.0, step=5.0, key="race_distance")
+        else:
+            segment_end, segment_length, segment_grade, segment_altitude = course
+            event_distance = segment_end[-1] / 1000
+            st.markdown(f"**Course distance:** {event_distance:.1f} km")
         
         # Add additional ride conditions for proper physics calculation
         st.markdown("#### Ride Conditions")
         
-        total_elevation = st.number_input("Total climb (m)", min_value=0, max_value=5000, value=100, step=50, key="race_elevation")
+        if course is None:
+            total_elevation = st.number_input("Total climb (m)", min_value=0, max_value=5000, value=100, step=50, key="race_elevation")
+        else:
+            total_elevation = elevation_gain(segment_length, segment_grade)
+            st.markdown(f"**Course climb:** {total_elevation:.0f} m")
         wind_speed = st.number_input("Wind (+ headwind, - tailwind) (km/h)", min_value=-50.0, max_value=50.0, value=0.0, step=1.0, key="race_wind")
         temperature = st.number_input("Temperature (°C)", min_value=-20, max_value=50, value=20, key="race_temp")
-        altitude = st.number_input("Altitude (m)", min_value=0, max_value=3000, value=100, key="race_altitude")
+        if course is None:
+            altitude = st.number_input("Altitude (m)", min_value=0, max_value=3000, value=100, key="race_altitude")
+        else:
+            altitude = float(np.mean(segment_altitude))
         
         # Calculate average grade
         avg_grade = 100 * (total_elevation / (event_distance * 1000)) if event_distance > 0 else 0
         st.markdown(f"**Average Grade:** {avg_grade:.2f}%")
         
         # Calculate air density
-        air_density = AIR_DENSITY_SEA_LEVEL * math.exp(-altitude/8000) * (273/(273+temperature))
+        air_density = calculate_air_density(temperature, altitude)
         
     with col2:
         st.markdown("#### Position & Equipment")
@@ -825,88 +1371,119 @@ with tab3:
         # Drivetrain efficiency
         drivetrain_efficiency_race = st.number_input("Drive train efficiency (%)", min_value=90.0, max_value=100.0, value=97.5, step=0.5, key="drive_eff_race")
         
+        timer.lap("inputs")
+        
         st.markdown("#### Predictions")
         
         # Basic power estimation based on event type
-        if event_type == "Time trial":
-            power_percent = 0.95
-        elif event_type == "Road race":
-            power_percent = 0.85
-        elif event_type == "Criterium":
-            power_percent = 0.90
-        else:  # Gran fondo
-            power_percent = 0.80
-                
+        power_percent = EVENT_POWER_PERCENT[event_type]
         sustainable_power = ftp_race * power_percent
         
         # Convert wind speed to m/s
         wind_speed_ms = wind_speed / 3.6
         
-        # Calculate speed using the physics-based model from tab1
-        def calculate_speed(power, total_weight, grade, cda, crr, wind_speed_ms, air_density, drivetrain_efficiency):
-            # Adjust power for drivetrain efficiency
-            power_at_wheel = power * (drivetrain_efficiency / 100)
-            
-            # Function to find speed given power
-            def power_diff(speed_ms):
-                # Speed relative to air (accounting for wind)
-                relative_speed_ms = speed_ms + wind_speed_ms
-                
-                # Rolling resistance force
-                f_rolling = total_weight * GRAVITY * crr * math.cos(math.atan(grade/100))
-                
-                # Grade resistance force
-                f_grade = total_weight * GRAVITY * math.sin(math.atan(grade/100))
-                
-                # Air resistance force
-                f_air = 0.5 * cda * air_density * relative_speed_ms**2
-                
-                # Total resistance force
-                f_total = f_rolling + f_grade + f_air
-                
-                # Power required
-                required_power = f_total * speed_ms
-                
-                return required_power - power_at_wheel
-            
-            # Binary search to find speed
-            speed_min, speed_max = 0.1, 30.0  # m/s
+        if power_model == "Critical power":
+            # The power that can be held for exactly the predicted finish time
+            if course is None:
+                sustainable_power, _, _ = solve_race_power(event_distance * 1000, race_cp, race_w_prime * 1000, total_weight_race,
+                                                           avg_grade, race_cda, race_crr, wind_speed_ms, air_density,
+                                                           drivetrain_efficiency_race)
+                sustainable_power = float(sustainable_power)
+            else:
+                sustainable_power = solve_course_race_power(segment_length, segment_grade, segment_altitude, race_cp,
+                                                            race_w_prime * 1000, total_weight_race, race_cda, race_crr,
+                                                            wind_speed_ms, temperature, drivetrain_efficiency_race)
+            power_percent = sustainable_power / ftp_race
+        
+        if course is None:
+            # Calculate the estimated speed using proper physics
+            speed_ms = calculate_speed(sustainable_power, total_weight_race, avg_grade, race_cda, race_crr, wind_speed_ms, air_density, drivetrain_efficiency_race)
+            estimated_speed = speed_ms * 3.6  # Convert to km/h
             
-            for _ in range(50):  # 50 iterations should be enough for good precision
-                speed_mid = (speed_min + speed_max) / 2
-                if power_diff(speed_mid) > 0:
-                    speed_max = speed_mid
-                else:
-                    speed_min = speed_mid
-                    
-            return (speed_min + speed_max) / 2
-        
-        # Calculate the estimated speed using proper physics
-        speed_ms = calculate_speed(sustainable_power, total_weight_race, avg_grade, race_cda, race_crr, wind_speed_ms, air_density, drivetrain_efficiency_race)
-        estimated_speed = speed_ms * 3.6  # Convert to km/h
-        
-        # Time calculation
-        time_hours = event_distance / estimated_speed if estimated_speed > 0 else 0
-        hours = int(time_hours)
-        minutes = int((time_hours - hours) * 60)
-        seconds = int(((time_hours - hours) * 60 - minutes) * 60)
-        estimated_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+            # Time calculation
+            time_hours = event_distance / estimated_speed if estimated_speed > 0 else 0
+        else:
+            # Solve every segment of the course in one pass
+            segment_speed, segment_time = simulate_course(segment_length, segment_grade, segment_altitude, sustainable_power,
+                                                          total_weight_race, race_cda, race_crr, wind_speed_ms, temperature,
+                                                          drivetrain_efficiency_race)
+            time_hours = segment_time.sum() / 3600
+            estimated_speed = event_distance / time_hours if time_hours > 0 else 0
+        estimated_time = format_time(time_hours * 3600)
+        timer.lap("physics solve")
         
         # Display results
         st.markdown(f"**Sustainable power:** {sustainable_power:.0f} watts ({power_percent*100:.0f}% of FTP)")
         st.markdown(f"**Estimated average speed:** {estimated_speed:.1f} km/h")
         st.markdown(f"**Estimated finish time:** {estimated_time}")
+        
+        if course is not None:
+            # Time-stepped simulation: speed carries over crests and builds up after climbs
+            if st.checkbox("Simulate acceleration and inertia", key="race_kinetic",
+                           help="Integrate the equation of motion instead of assuming steady speed on every segment"):
+                time_step = st.select_slider("Time step (s)", options=[0.25, 0.5, 1.0, 2.0, 5.0], value=1.0, key="race_time_step")
+                try:
+                    kinetic_time = kinetic_finish_time(segment_end, segment_grade, segment_altitude, sustainable_power,
+                                                       total_weight_race, race_cda, race_crr, wind_speed_ms, temperature,
+                                                       drivetrain_efficiency_race, time_step)
+                    st.markdown(f"**Finish time with inertia:** {format_time(kinetic_time)}")
+                except ValueError as error:
+                    st.warning(f"{error} at {sustainable_power:.0f} W")
             
-        # Simple pacing advice
         st.markdown("#### Pacing Advice")
-        st.markdown(f"- **Start:** {sustainable_power * 1.05:.0f} watts (first few minutes)")
-        st.markdown(f"- **Middle:** {sustainable_power:.0f} watts (maintain steady effort)")
-        st.markdown(f"- **Finish:** {sustainable_power * 1.03:.0f} watts (if you feel strong)")
+        if course is None:
+            # Simple pacing advice
+            st.markdown(f"- **Start:** {sustainable_power * 1.05:.0f} watts (first few minutes)")
+            st.markdown(f"- **Middle:** {sustainable_power:.0f} watts (maintain steady effort)")
+            st.markdown(f"- **Finish:** {sustainable_power * 1.03:.0f} watts (if you feel strong)")
+            
+            # Steady power above CP drains W' at a constant rate
+            if sustainable_power > race_cp and race_w_prime * 1000 / (sustainable_power - race_cp) < time_hours * 3600:
+                exhausted_after = race_w_prime * 1000 / (sustainable_power - race_cp)
+                st.warning(f"At {sustainable_power:.0f} W, W′ runs out after {format_time(exhausted_after)}")
+        else:
+            # Vary power with the terrain at the same normalized power as the even-power ride
+            max_power_percent = st.number_input("Max power (% of FTP)", min_value=100, max_value=200, value=150, step=5,
+                                                key="race_max_power")
+            plan_power, plan_speed, plan_time = pacing_plan(segment_length, segment_grade, segment_altitude, sustainable_power,
+                                                            total_weight_race, race_cda, race_crr, wind_speed_ms, temperature,
+                                                            drivetrain_efficiency_race, ftp_race * max_power_percent / 100)
+            # Slower than even power when the max power cap is below the even power
+            time_saved = segment_time.sum() - plan_time.sum()
+            st.markdown(f"**Optimal finish time:** {format_time(plan_time.sum())} "
+                        f"({format_time(abs(time_saved))} {'faster' if time_saved >= 0 else 'slower'} "
+                        f"at {sustainable_power:.0f} W NP)")
+            if time_saved < 0:
+                st.warning(f"The max power of {max_power_percent}% of FTP is below the even power of "
+                           f"{power_percent * 100:.0f}% of FTP; raise it to pace above the even power on climbs")
+            
+            # Flag where the plan would empty the anaerobic reserve
+            plan_balance = w_prime_balance(plan_power, race_cp, race_w_prime * 1000, dt=plan_time)
+            st.markdown(f"**Lowest W′ balance:** {plan_balance.min() / 1000:.1f} kJ")
+            first, last = exhausted_intervals(plan_balance)
+            if len(first):
+                ranges = ", ".join(f"{(segment_end[i] - segment_length[i]) / 1000:.1f}-{segment_end[j] / 1000:.1f} km"
+                                   for i, j in zip(first, last))
+                st.warning(f"This plan empties W′ at {ranges}; lower the max power")
+            
+            plan_df = pd.DataFrame({
+                "distance_km": np.round(segment_end / 1000, 3),
+                "grade_percent": np.round(segment_grade, 2),
+                "power_w": np.round(plan_power),
+                "speed_kmh": np.round(plan_speed * 3.6, 1),
+                "elapsed_s": np.round(np.cumsum(plan_time)),
+                "w_balance_kj": np.round(plan_balance / 1000, 2),
+            })
+            st.download_button("Download pacing plan (CSV)", plan_df.to_csv(index=False), file_name="pacing_plan.csv",
+                               mime="text/csv", key="race_pacing_download")
+    
+    timer.lap("inertia and pacing")
     
     # Calculate normalized power and TSS
-    intensity_factor = sustainable_power / ftp_race if ftp_race > 0 else 0
+    intensity_factor = calculate_intensity_factor(sustainable_power, ftp_race)
     normalized_power = sustainable_power  # Simplified for steady state
-    training_stress_score = (time_hours * 3600) * (normalized_power / ftp_race) ** 2 * 100 / 3600 if ftp_race > 0 else 0
+    training_stress_score = calculate_tss(time_hours * 3600, normalized_power, ftp_race)
+    timer.lap("derived metrics")
     
     # Display additional metrics
     metrics_col1, metrics_col2 = st.columns(2)
@@ -916,6 +1493,75 @@ with tab3:
         st.markdown(f"**Intensity Factor:** {intensity_factor:.2f} IF")
         st.markdown(f"**Training Stress Score:** {training_stress_score:.1f} TSS")
     
+    if course is not None:
+        with metrics_col2:
+            st.markdown("#### Splits")
+            split_distance, split_elapsed = course_splits(segment_end, segment_time)
+            splits_df = pd.DataFrame({
+                "Distance (km)": [f"{d / 1000:.1f}" for d in split_distance],
+                "Elapsed": [format_time(t) for t in split_elapsed],
+            })
+            st.dataframe(splits_df, hide_index=True, use_container_width=True)
+        
+        timer.lap("metrics and splits")
+        
+        fig = course_profile_figure(segment_end, segment_grade, segment_altitude, segment_speed)
+        timer.lap("course profile figure")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig = pacing_figure(segment_end, plan_power, sustainable_power, plan_balance)
+        timer.lap("pacing figure")
+        st.plotly_chart(fig, use_container_width=True)
+        timer.lap("chart render")
+    
+    if power_model == "Critical power":
+        # Every distance in one vectorized solve, at the event's average grade
+        st.markdown("#### Predicted Times by Distance")
+        table_distance = np.array([10, 20, 40, 80, 100, 160, 200], dtype=float)
+        table_power, table_speed, table_time = solve_race_power(table_distance * 1000, race_cp, race_w_prime * 1000,
+                                                                total_weight_race, avg_grade, race_cda, race_crr,
+                                                                wind_speed_ms, air_density, drivetrain_efficiency_race)
+        distance_df = pd.DataFrame({
+            "Distance (km)": table_distance.astype(int),
+            "Power (watts)": np.round(table_power).astype(int),
+            "Speed (km/h)": np.round(table_speed * 3.6, 1),
+            "Time": [format_time(t) for t in table_time],
+        })
+        st.dataframe(distance_df, hide_index=True, use_container_width=True)
+        timer.lap("distance table")
+
+    # Spread of finish times when power, position, tires and weather are uncertain
+    st.markdown("#### Finish Time Uncertainty")
+    if st.checkbox("Simulate uncertain conditions (Monte Carlo)", key="race_monte_carlo",
+                   help="Ride the event many times with power, CdA, Crr, wind and temperature drawn from normal distributions"):
+        spread_col1, spread_col2, spread_col3 = st.columns(3)
+        with spread_col1:
+            power_sd = st.number_input("Power spread (± % SD)", min_value=0.0, max_value=20.0, value=3.0, step=0.5, key="race_power_sd")
+            cda_sd = st.number_input("CdA spread (± SD)", min_value=0.0, max_value=0.1, value=0.01, step=0.005, format="%.3f", key="race_cda_sd")
+        with spread_col2:
+            crr_sd = st.number_input("Crr spread (± SD)", min_value=0.0, max_value=0.003, value=0.0003, step=0.0001, format="%.4f", key="race_crr_sd")
+            wind_sd = st.number_input("Wind spread (± km/h SD)", min_value=0.0, max_value=30.0, value=5.0, step=1.0, key="race_wind_sd")
+        with spread_col3:
+            temperature_sd = st.number_input("Temperature spread (± °C SD)", min_value=0.0, max_value=15.0, value=3.0, step=0.5, key="race_temp_sd")
+            draws = st.select_slider("Simulated rides", options=[1_000, 10_000, 100_000], value=100_000, key="race_draws")
+
+        if course is None:
+            mc_length, mc_grade, mc_altitude = np.array([event_distance * 1000]), np.array([avg_grade]), np.array([float(altitude)])
+        else:
+            mc_length, mc_grade, mc_altitude = segment_length, segment_grade, segment_altitude
+        percentiles, counts, edges = finish_time_distribution(
+            mc_length, mc_grade, mc_altitude, sustainable_power, total_weight_race, race_cda, race_crr, wind_speed_ms,
+            temperature, drivetrain_efficiency_race, power_sd / 100, cda_sd, crr_sd, wind_sd / 3.6, temperature_sd,
+            draws, 0)
+        timer.lap("monte carlo")
+
+        p5_col, p50_col, p95_col = st.columns(3)
+        p5_col.metric("Fast day (P5)", format_time(percentiles[0]))
+        p50_col.metric("Median (P50)", format_time(percentiles[1]))
+        p95_col.metric("Slow day (P95)", format_time(percentiles[2]))
+        st.plotly_chart(finish_time_figure(counts, edges, percentiles), use_container_width=True)
+        timer.lap("monte carlo figure")
+
     # Classification table
     st.markdown("---")
     st.markdown("### Rider Classification")
@@ -952,3 +1598,54 @@ with tab3:
         user_category = "Beginner"
             
     st.markdown(f"**Your rider category based on power-to-weight ratio: {user_category}**")
+    timer.lap("classification")
+
+# Create tabs for different calculator modes
+tab1, tab2, tab3 = st.tabs(["Power-Speed Calculator", "Training Metrics", "Race Predictor"])
+
+with tab1:
+    power_speed_calculator_tab()
+
+with tab2:
+    training_metrics_tab()
+
+with tab3:
+    race_predictor_tab()
+
+# Sidebar performance panel (see PERF_ENABLED). Most widget changes rerun
+# only their tab's fragment, not this part of the script, so the panel is a
+# fragment of its own that redraws on a timer.
+PERF_REFRESH_SECONDS = 2
+
+def reset_perf_stats():
+    stats = perf_stats()
+    stats["functions"].clear()
+    stats["stages"].clear()
+
+@st.fragment(run_every=PERF_REFRESH_SECONDS)
+def performance_panel():
+    stats = perf_stats()
+    st.markdown("### Performance")
+    st.caption(f"Latest run of each stage, refreshed every {PERF_REFRESH_SECONDS} s.")
+    
+    stages_df = pd.DataFrame({
+        "Stage": list(stats["stages"]),
+        "Time (ms)": [round(seconds * 1000, 2) for seconds in stats["stages"].values()],
+    })
+    st.dataframe(stages_df, hide_index=True, use_container_width=True)
+    
+    st.markdown("#### Cached functions")
+    functions = stats["functions"]
+    functions_df = pd.DataFrame({
+        "Function": list(functions),
+        "Calls": [f["calls"] for f in functions.values()],
+        "Hit rate": [f"{(f['calls'] - f['misses']) / f['calls']:.0%}" if f["calls"] else "-" for f in functions.values()],
+        "Time (ms)": [round(f["seconds"] * 1000, 2) for f in functions.values()],
+    })
+    st.dataframe(functions_df, hide_index=True, use_container_width=True)
+    
+    st.button("Reset counters", key="perf_reset", on_click=reset_perf_stats)
+
+if PERF_ENABLED:
+    with st.sidebar:
+        performance_panel()